@@ -0,0 +1,231 @@
+# Batch analysis: searches every position of EPD or PGN files over a pool of
+# processes and writes one result per position as JSON lines or CSV.
+#
+# Positions are read lazily and only a few tasks per process are in flight, so
+# memory stays flat whatever the size of the input. Each process keeps its GameState
+# and transposition table between positions.
+#
+# python3 BatchAnalysis.py positions.epd --movetime 1000 --out results.jsonl
+# python3 BatchAnalysis.py games.pgn --depth 6 --every 2 --out results.csv
+import argparse
+import collections
+import csv
+import json
+import multiprocessing
+import sys
+import time
+import ChessAI
+import ChessEngine
+import BitboardEngine
+from OpeningBook import readPgnGames
+
+FIELDS = [
+    "id",
+    "fen",
+    "bestmove",
+    "san",
+    "score",
+    "depth",
+    "nodes",
+    "time",
+    "bm",
+    "error",
+]
+# tasks in flight per process
+QUEUE_DEPTH = 4
+
+# GameState reused by every task of a worker process
+workerState = None
+
+
+# Runs once in every worker process
+def initWorker(hashMb, tablebases):
+    global workerState
+    workerState = BitboardEngine.GameState()
+    ChessAI.setHashSize(hashMb)
+    if tablebases is not None:
+        ChessAI.setTablebase(tablebases)
+
+
+# Yields (id, epd) for every position of an EPD file, the id being its id operation
+# or its line number
+def readEpd(file):
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if line != "" and not line.startswith("#"):
+            yield "line " + str(number), line
+
+
+# Yields (id, epd) for the positions of every game of a PGN file, every plies half
+# moves starting after skip
+def readPgn(file, every=1, skip=0):
+    gs = BitboardEngine.GameState()
+    start = gs.getPosition()
+    for game, sanMoves in enumerate(readPgnGames(file), 1):
+        gs.setPosition(start)
+        for ply, san in enumerate(sanMoves):
+            if ply >= skip and (ply - skip) % every == 0:
+                counters = gs.getFen().split()[4:]
+                epd = gs.getEpd({"hmvc": counters[0], "fmvn": counters[1]})
+                yield "game %d ply %d" % (game, ply), epd
+            try:
+                gs.makeMove(gs.parseSan(san))
+            except ValueError:
+                # rest of a broken game is skipped
+                break
+
+
+# Searches one position in a worker given:
+# label : id of the position when the EPD has no id operation
+# epd : position with its operations
+# moveTime : milliseconds per position, or None to search to maxDepth
+# Returns the result as a dict of FIELDS, a record that can't be read gets a result
+# with only its error so one bad line doesn't stop the run
+def analyze(label, epd, moveTime, maxDepth):
+    gs = workerState
+    result = dict.fromkeys(FIELDS)
+    try:
+        operations = gs.setEpd(epd)
+    except (ValueError, KeyError) as error:
+        result["id"] = label
+        result["error"] = "invalid EPD: " + str(error)
+        return result
+    result["id"] = operations.get("id", [label])[0]
+    result["fen"] = gs.getFen()
+    result["bm"] = " ".join(operations.get("bm", []))
+    last = [None, 0, 0]
+
+    def onIteration(depth, score, nodes, seconds, pv):
+        last[:] = [score, depth, nodes]
+
+    start = time.time()
+    move = ChessAI.iterativeDeepening(
+        gs,
+        1 if gs.whiteTurn else -1,
+        moveTime=moveTime,
+        maxDepth=maxDepth,
+        onIteration=onIteration,
+    )
+    result["time"] = round(time.time() - start, 3)
+    result["bestmove"] = None if move is None else ChessEngine.moveNotation(move)
+    result["san"] = None if move is None else gs.toSan(move)
+    result["score"], result["depth"], result["nodes"] = last
+    return result
+
+
+# Writes results as JSON lines or CSV, flushing after each one
+class ResultWriter:
+    # outputFormat : "jsonl" or "csv"
+    def __init__(self, file, outputFormat):
+        self.file = file
+        self.writer = None
+        if outputFormat == "csv":
+            self.writer = csv.DictWriter(file, FIELDS)
+            self.writer.writeheader()
+
+    def write(self, result):
+        if self.writer is None:
+            self.file.write(json.dumps(result) + "\n")
+        else:
+            self.writer.writerow(result)
+        self.file.flush()
+
+
+# Analyzes every (id, epd) of positions and writes the results in input order given:
+# writer : ResultWriter
+# processes : number of worker processes, 1 analyzes in this process
+# other arguments as analyze and initWorker
+# Returns the number of positions analyzed.
+def analyzeAll(
+    positions,
+    writer,
+    processes=None,
+    moveTime=None,
+    maxDepth=64,
+    hashMb=16,
+    tablebases=None,
+):
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    count = 0
+    if processes == 1:
+        initWorker(hashMb, tablebases)
+        for label, epd in positions:
+            writer.write(analyze(label, epd, moveTime, maxDepth))
+            count += 1
+        return count
+
+    pool = multiprocessing.Pool(
+        processes=processes, initializer=initWorker, initargs=(hashMb, tablebases)
+    )
+    try:
+        # Pool.imap would read the whole input ahead, so tasks are submitted as
+        # results come back
+        pending = collections.deque()
+        for label, epd in positions:
+            pending.append(
+                pool.apply_async(analyze, (label, epd, moveTime, maxDepth))
+            )
+            if len(pending) >= processes * QUEUE_DEPTH:
+                writer.write(pending.popleft().get())
+                count += 1
+        while pending:
+            writer.write(pending.popleft().get())
+            count += 1
+    finally:
+        pool.terminate()
+        pool.join()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch position analysis")
+    parser.add_argument("inputs", nargs="+", help="EPD or PGN files")
+    parser.add_argument("--out", help="output file, .csv for CSV, stdout by default")
+    parser.add_argument("--format", choices=("jsonl", "csv"))
+    parser.add_argument("--movetime", type=int, help="milliseconds per position")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--hash", type=int, default=16, help="megabytes per process")
+    parser.add_argument("--tablebases", help="folder of endgame tables")
+    parser.add_argument("--every", type=int, default=1, help="PGN plies per position")
+    parser.add_argument("--skip", type=int, default=0, help="PGN opening plies skipped")
+    args = parser.parse_args()
+    if args.movetime is None and args.depth is None:
+        parser.error("give --movetime or --depth")
+
+    outputFormat = args.format
+    if outputFormat is None:
+        csvOut = args.out is not None and args.out.endswith(".csv")
+        outputFormat = "csv" if csvOut else "jsonl"
+
+    def positions():
+        for path in args.inputs:
+            with open(path, encoding="utf-8", errors="replace") as file:
+                if path.lower().endswith(".pgn"):
+                    yield from readPgn(file, args.every, args.skip)
+                else:
+                    yield from readEpd(file)
+
+    out = sys.stdout if args.out is None else open(args.out, "w", newline="")
+    start = time.time()
+    try:
+        count = analyzeAll(
+            positions(),
+            ResultWriter(out, outputFormat),
+            args.processes,
+            args.movetime,
+            args.depth or 64,
+            args.hash,
+            args.tablebases,
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.time() - start
+    print("%d positions in %.1fs" % (count, elapsed), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
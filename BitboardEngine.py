@@ -0,0 +1,408 @@
+# Bitboard backend for GameState: the same makeMove/undoMove/getValidMoves contract
+# as ChessEngine.GameState, with move generation done on 64 bit integers (one per
+# piece type and colour) instead of walking the board list square by square.
+# The board list is still kept up to date for drawing, notation and evaluation.
+# Square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1.
+import ChessEngine
+from ChessEngine import (
+    CAPTURE,
+    DOUBLE_PUSH,
+    EN_PASSANT,
+    KING_CASTLE,
+    PIECES,
+    PROMOTION,
+    QUEEN_CASTLE,
+)
+import ZobristHash as hash
+
+WHITE = 0
+BLACK = 1
+
+# Offsets into GameState.pieces, which is indexed like ZobristHash.PIECE_INDEX
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+FULL = (1 << 64) - 1
+
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_DIRECTIONS = (
+    (-2, -1),
+    (-1, -2),
+    (1, -2),
+    (2, -1),
+    (2, 1),
+    (1, 2),
+    (-1, 2),
+    (-2, 1),
+)
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+# Returns the bitboard of the squares reached by stepping once in each direction
+def stepAttacks(row, col, directions):
+    attacks = 0
+    for d in directions:
+        endRow = row + d[0]
+        endCol = col + d[1]
+        if 0 <= endRow < 8 and 0 <= endCol < 8:
+            attacks |= 1 << (endRow * 8 + endCol)
+    return attacks
+
+
+# Returns the bitboard of the squares after sq in direction d, up to the edge
+def rayAttacks(sq, d):
+    ray = 0
+    row, col = divmod(sq, 8)
+    row += d[0]
+    col += d[1]
+    while 0 <= row < 8 and 0 <= col < 8:
+        ray |= 1 << (row * 8 + col)
+        row += d[0]
+        col += d[1]
+    return ray
+
+
+KNIGHT_ATTACKS = [stepAttacks(sq // 8, sq % 8, KNIGHT_DIRECTIONS) for sq in range(64)]
+KING_ATTACKS = [stepAttacks(sq // 8, sq % 8, KING_DIRECTIONS) for sq in range(64)]
+# PAWN_ATTACKS[color][sq] : squares attacked by a pawn of color standing on sq
+PAWN_ATTACKS = [
+    [stepAttacks(sq // 8, sq % 8, ((-1, -1), (-1, 1))) for sq in range(64)],
+    [stepAttacks(sq // 8, sq % 8, ((1, -1), (1, 1))) for sq in range(64)],
+]
+
+# Rays per direction as (rays by square, True if the ray goes towards higher squares).
+# The nearest blocker on a ray is its lowest set bit for increasing rays and its
+# highest set bit otherwise.
+ROOK_RAYS = [
+    ([rayAttacks(sq, d) for sq in range(64)], d[0] * 8 + d[1] > 0)
+    for d in ROOK_DIRECTIONS
+]
+BISHOP_RAYS = [
+    ([rayAttacks(sq, d) for sq in range(64)], d[0] * 8 + d[1] > 0)
+    for d in BISHOP_DIRECTIONS
+]
+
+
+# Returns the attacks of a slider on sq given the occupied squares, using the
+# classical ray approach: the ray beyond the nearest blocker is masked away
+def slidingAttacks(sq, occupied, rays):
+    attacks = 0
+    for ray, increasing in rays:
+        targets = ray[sq]
+        blockers = targets & occupied
+        if blockers:
+            if increasing:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            targets ^= ray[blocker]
+        attacks |= targets
+    return attacks
+
+
+# BETWEEN[a][b] : squares strictly between a and b on a shared line, otherwise 0
+# LINE[a][b] : the whole line through a and b, otherwise 0
+BETWEEN = [[0] * 64 for sq in range(64)]
+LINE = [[0] * 64 for sq in range(64)]
+for start in range(64):
+    for d in KING_DIRECTIONS:
+        line = rayAttacks(start, d) | rayAttacks(start, (-d[0], -d[1])) | (1 << start)
+        between = 0
+        row, col = divmod(start, 8)
+        row += d[0]
+        col += d[1]
+        while 0 <= row < 8 and 0 <= col < 8:
+            end = row * 8 + col
+            BETWEEN[start][end] = between
+            LINE[start][end] = line
+            between |= 1 << end
+            row += d[0]
+            col += d[1]
+
+# Squares the king crosses (and must not be attacked on) and squares that must be
+# empty, for (kingside, queenside) castling of each colour
+CASTLE_SAFE = [((61, 62), (59, 58)), ((5, 6), (3, 2))]
+CASTLE_EMPTY = [
+    ((1 << 61) | (1 << 62), (1 << 59) | (1 << 58) | (1 << 57)),
+    ((1 << 5) | (1 << 6), (1 << 3) | (1 << 2) | (1 << 1)),
+]
+
+
+class GameState(ChessEngine.GameState):
+    def __init__(self):
+        super().__init__()
+        self.initBitboards()
+
+    # Builds the bitboards from the board list
+    def initBitboards(self):
+        self.pieces = [0] * 12
+        self.colorOccupancy = [0, 0]
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    bit = 1 << (row * 8 + col)
+                    self.pieces[hash.indexOf(piece)] |= bit
+                    self.colorOccupancy[WHITE if piece[0] == "w" else BLACK] |= bit
+        self.occupied = self.colorOccupancy[WHITE] | self.colorOccupancy[BLACK]
+
+    def setPosition(self, position):
+        super().setPosition(position)
+        self.initBitboards()
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        self.toggleMove(self.undoLog[-1][0])
+
+    def undoMove(self):
+        if len(self.undoLog) != 0:
+            entry = self.undoLog[-1][0]
+            super().undoMove()
+            self.toggleMove(entry)
+
+    # XORs a move log entry in or out of the bitboards (doing it twice restores them)
+    def toggleMove(self, entry):
+        pieces = self.pieces
+        startSq = entry & 63
+        endSq = (entry >> 6) & 63
+        flags = (entry >> 12) & 15
+        moved = (entry >> 16) & 15
+        captured = entry >> 20
+        color = WHITE if moved < 6 else BLACK
+        start = 1 << startSq
+        end = 1 << endSq
+        pieces[moved] ^= start
+        if flags & PROMOTION:
+            pieces[color * 6 + KNIGHT + (flags & 3)] ^= end
+        else:
+            pieces[moved] ^= end
+        self.colorOccupancy[color] ^= start | end
+
+        if PIECES[captured] != "--":
+            if flags == EN_PASSANT:
+                capturedBit = 1 << (startSq - startSq % 8 + endSq % 8)
+            else:
+                capturedBit = end
+            pieces[captured] ^= capturedBit
+            self.colorOccupancy[1 - color] ^= capturedBit
+
+        if flags == KING_CASTLE or flags == QUEEN_CASTLE:
+            if flags == KING_CASTLE:
+                rookHop = (1 << (endSq + 1)) | (1 << (endSq - 1))
+            else:
+                rookHop = (1 << (endSq - 2)) | (1 << (endSq + 1))
+            pieces[color * 6 + ROOK] ^= rookHop
+            self.colorOccupancy[color] ^= rookHop
+
+        self.occupied = self.colorOccupancy[WHITE] | self.colorOccupancy[BLACK]
+
+    def kingInCheck(self):
+        color = WHITE if self.whiteTurn else BLACK
+        kingSq = self.pieces[color * 6 + KING].bit_length() - 1
+        return self.attackersOf(kingSq, 1 - color, self.occupied) != 0
+
+    # Returns the bitboard of pieces of color attacking sq given the occupied squares
+    def attackersOf(self, sq, color, occupied):
+        enemy = self.pieces[color * 6 : color * 6 + 6]
+        attackers = (KNIGHT_ATTACKS[sq] & enemy[KNIGHT]) | (
+            PAWN_ATTACKS[1 - color][sq] & enemy[PAWN]
+        )
+        attackers |= KING_ATTACKS[sq] & enemy[KING]
+        diagonal = enemy[BISHOP] | enemy[QUEEN]
+        if diagonal:
+            attackers |= slidingAttacks(sq, occupied, BISHOP_RAYS) & diagonal
+        straight = enemy[ROOK] | enemy[QUEEN]
+        if straight:
+            attackers |= slidingAttacks(sq, occupied, ROOK_RAYS) & straight
+        return attackers
+
+    # Returns the bitboard of our pieces pinned to our king on kingSq
+    def pinnedPieces(self, kingSq, color, occupied):
+        enemy = self.pieces[(1 - color) * 6 : (1 - color) * 6 + 6]
+        own = self.colorOccupancy[color]
+        opponent = self.colorOccupancy[1 - color]
+        # enemy sliders that would attack the king if only enemy pieces blocked
+        snipers = slidingAttacks(kingSq, opponent, ROOK_RAYS) & (
+            enemy[ROOK] | enemy[QUEEN]
+        )
+        snipers |= slidingAttacks(kingSq, opponent, BISHOP_RAYS) & (
+            enemy[BISHOP] | enemy[QUEEN]
+        )
+        pinned = 0
+        while snipers:
+            low = snipers & -snipers
+            snipers ^= low
+            blockers = BETWEEN[kingSq][low.bit_length() - 1] & occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & own:
+                pinned |= blockers
+        return pinned
+
+    def getValidMoves(self):
+        moves = self.getAllPossibleMoves()
+        if len(moves) == 0:
+            if self.inCheck:
+                self.checkMate = True
+            else:
+                self.staleMate = True
+        return moves
+
+    # Returns the legal moves of the side to move (unlike the list based generator,
+    # which leaves check evasion to getValidMoves)
+    def getAllPossibleMoves(self):
+        moves = []
+        color = WHITE if self.whiteTurn else BLACK
+        enemyColor = 1 - color
+        own = self.pieces[color * 6 : color * 6 + 6]
+        ownOccupancy = self.colorOccupancy[color]
+        notOwn = FULL ^ ownOccupancy
+        occupied = self.occupied
+        kingSq = own[KING].bit_length() - 1
+        opponent = self.colorOccupancy[enemyColor]
+
+        checkers = self.attackersOf(kingSq, enemyColor, occupied)
+        self.inCheck = checkers != 0
+
+        # King moves, the king itself must not block attacks on its target
+        withoutKing = occupied ^ (1 << kingSq)
+        targets = KING_ATTACKS[kingSq] & notOwn
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            end = low.bit_length() - 1
+            if not self.attackersOf(end, enemyColor, withoutKing):
+                flags = CAPTURE if low & opponent else 0
+                moves.append(kingSq | (end << 6) | (flags << 12))
+
+        # Only the king can move out of a double check
+        if checkers & (checkers - 1):
+            return moves
+
+        if checkers:
+            # capture the checker or block the check
+            evasions = checkers | BETWEEN[kingSq][checkers.bit_length() - 1]
+        else:
+            evasions = FULL
+            self.addCastleMoves(kingSq, color, moves)
+
+        pinned = self.pinnedPieces(kingSq, color, occupied)
+        targetMask = notOwn & evasions
+
+        knights = own[KNIGHT] & ~pinned
+        while knights:
+            low = knights & -knights
+            knights ^= low
+            start = low.bit_length() - 1
+            self.addMoves(start, KNIGHT_ATTACKS[start] & targetMask, moves)
+
+        for pieces, rays in (
+            (own[BISHOP] | own[QUEEN], BISHOP_RAYS),
+            (own[ROOK] | own[QUEEN], ROOK_RAYS),
+        ):
+            while pieces:
+                low = pieces & -pieces
+                pieces ^= low
+                start = low.bit_length() - 1
+                targets = slidingAttacks(start, occupied, rays) & targetMask
+                if low & pinned:
+                    targets &= LINE[kingSq][start]
+                self.addMoves(start, targets, moves)
+
+        self.addPawnMoves(own[PAWN], color, kingSq, pinned, evasions, moves)
+        return moves
+
+    # Appends a move from start to every square of targets
+    def addMoves(self, start, targets, moves):
+        opponent = self.colorOccupancy[BLACK if self.whiteTurn else WHITE]
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            flags = CAPTURE if low & opponent else 0
+            moves.append(start | ((low.bit_length() - 1) << 6) | (flags << 12))
+
+    def addPawnMoves(self, pawns, color, kingSq, pinned, evasions, moves):
+        occupied = self.occupied
+        opponent = self.colorOccupancy[1 - color]
+        forward = -8 if color == WHITE else 8
+        doubleRow = 6 if color == WHITE else 1
+        if self.enpassant != ():
+            enpassantBit = 1 << (self.enpassant[0] * 8 + self.enpassant[1])
+        else:
+            enpassantBit = 0
+
+        while pawns:
+            low = pawns & -pawns
+            pawns ^= low
+            start = low.bit_length() - 1
+            allowed = evasions
+            if low & pinned:
+                allowed &= LINE[kingSq][start]
+
+            # pushes
+            end = start + forward
+            if not occupied & (1 << end):
+                if allowed & (1 << end):
+                    self.addPawnMove(start, end, 0, moves)
+                if start >> 3 == doubleRow:
+                    end += forward
+                    if not occupied & (1 << end) and allowed & (1 << end):
+                        moves.append(start | (end << 6) | (DOUBLE_PUSH << 12))
+
+            # captures
+            attacks = PAWN_ATTACKS[color][start]
+            targets = attacks & opponent & allowed
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                self.addPawnMove(start, low.bit_length() - 1, CAPTURE, moves)
+
+            if attacks & enpassantBit and self.enpassantIsLegal(
+                start, enpassantBit, color, kingSq
+            ):
+                end = enpassantBit.bit_length() - 1
+                moves.append(start | (end << 6) | (EN_PASSANT << 12))
+
+    # Appends a pawn move, as one move per promotion piece (queen first) when it
+    # reaches the last row
+    def addPawnMove(self, start, end, flags, moves):
+        move = start | (end << 6)
+        if end < 8 or end >= 56:
+            for piece in (3, 2, 1, 0):
+                moves.append(move | ((flags | PROMOTION | piece) << 12))
+        else:
+            moves.append(move | (flags << 12))
+
+    # En passant removes two pieces from a line at once, so it is tested by playing
+    # it on the occupancy and looking for attacks on the king
+    def enpassantIsLegal(self, start, enpassantBit, color, kingSq):
+        end = enpassantBit.bit_length() - 1
+        captured = end + (8 if color == WHITE else -8)
+        occupied = (self.occupied ^ (1 << start) ^ (1 << captured)) | enpassantBit
+        enemyColor = 1 - color
+        enemy = self.pieces[enemyColor * 6 : enemyColor * 6 + 6]
+        enemyPawns = enemy[PAWN] ^ (1 << captured)
+        if PAWN_ATTACKS[color][kingSq] & enemyPawns:
+            return False
+        if KNIGHT_ATTACKS[kingSq] & enemy[KNIGHT]:
+            return False
+        if slidingAttacks(kingSq, occupied, BISHOP_RAYS) & (
+            enemy[BISHOP] | enemy[QUEEN]
+        ):
+            return False
+        if slidingAttacks(kingSq, occupied, ROOK_RAYS) & (enemy[ROOK] | enemy[QUEEN]):
+            return False
+        return True
+
+    def addCastleMoves(self, kingSq, color, moves):
+        # kingside then queenside bit of the color
+        rights = self.castle >> (2 * color)
+        for side in range(2):
+            if not (rights >> side) & 1 or self.occupied & CASTLE_EMPTY[color][side]:
+                continue
+            if any(
+                self.attackersOf(sq, 1 - color, self.occupied)
+                for sq in CASTLE_SAFE[color][side]
+            ):
+                continue
+            end = CASTLE_SAFE[color][side][1]
+            flags = KING_CASTLE if side == 0 else QUEEN_CASTLE
+            moves.append(kingSq | (end << 6) | (flags << 12))
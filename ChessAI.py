@@ -1,100 +1,682 @@
 # Chess AI written by Alex Zhao
 
+import atexit
 import math
+import time
 import ChessEngine
-import copy
 import multiprocessing
-from functools import partial
+from OpeningBook import OpeningBook
+import Tablebase
+from ChessEngine import CAPTURE, EN_PASSANT, NULL_MOVE, PROMOTION, QUEEN_PROMOTION
+from TranspositionTable import (
+    TranspositionTable,
+    SharedTranspositionTable,
+    EXACT,
+    LOWERBOUND,
+    UPPERBOUND,
+)
+
+# Shared by minimax and alphabeta, each worker process has its own copy
+transpositionTable = TranspositionTable()
+# Consulted before iterativeDeepening and lazySmp search, see setOpeningBook
+openingBook = None
+# Exact results of small endings, probed by every search, see setTablebase
+tablebase = None
+
+# Search statistics and time control of the current search
+nodes = 0
+# How often the selective techniques fired, reset together with nodes
+stats = {"nullMoveCutoffs": 0, "reductions": 0, "reSearches": 0}
+deadline = None
+# Shared flag ending the search early when its value is set, used by Lazy SMP helpers
+stopSignal = None
+# time.time() at which the search stops, set from outside a running search (UCI
+# ponderhit). Unlike deadline no search ever resets it, so it can be set before the
+# search has started.
+stopTime = None
+
+# Mates score MATE minus the plies from the root to the mate, every score of at
+# least MATE_BOUND is a mate. Tablebase wins count plies from the root the same way
+# below them, see Tablebase.scoreOf.
+MATE = 11000
+MATE_BOUND = 10000
+# Number of moves on the undo log at the root of the current search
+rootPly = 0
+
+# Fraction of the remaining clock spent on one move when no move time is given
+MOVES_TO_GO = 30
+# Milliseconds kept back from the clock for move transmission and overhead
+MOVE_OVERHEAD = 50
+
+# Width of the null window of principal variation search, the smallest score step
+# of evaluate (scores are whole thousandths of a pawn)
+NULL_WINDOW = 0.001
+# Half width of the first aspiration window around the previous iteration's score,
+# multiplied by ASPIRATION_GROWTH after every fail, beyond ASPIRATION_MAX the
+# window is opened completely
+ASPIRATION_WINDOW = 0.25
+ASPIRATION_GROWTH = 4
+ASPIRATION_MAX = 10
+
+# Null move pruning: if passing still fails high on a search NULL_MOVE_REDUCTION
+# plies shallower, the node is cut off. Needs at least NULL_MOVE_MIN_DEPTH.
+nullMovePruning = True
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+# Late move reductions: quiet moves after the first LMR_MOVES are searched one ply
+# shallower (two after LMR_LATE_MOVES), and again at full depth if they beat alpha
+lateMoveReductions = True
+LMR_MOVES = 3
+LMR_LATE_MOVES = 8
+LMR_MIN_DEPTH = 3
+
+
+# Raised from inside the search once the deadline has passed
+class SearchTimeout(Exception):
+    pass
+
+
+# Sets the memory cap (in megabytes) of the transposition table
+def setHashSize(sizeMb):
+    transpositionTable.resize(sizeMb)
+
+
+# Opens the opening book file at path (None to stop using a book)
+def setOpeningBook(path):
+    global openingBook
+    if openingBook is not None:
+        openingBook.close()
+    openingBook = None if path is None else OpeningBook(path)
+
+
+# Returns a move of the opening book for the position of gs, or None
+def bookMove(gs):
+    if openingBook is None:
+        return None
+    return openingBook.chooseMove(gs)
+
+
+# Uses the endgame tables in directory (None to stop using tablebases), worker
+# processes are restarted to pick them up
+def setTablebase(directory):
+    global tablebase
+    if tablebase is not None:
+        tablebase.close()
+    tablebase = None if directory is None else Tablebase.Tablebase(directory)
+    closePool()
+    closeSmpPool()
+
+
+# Returns the best move of the tablebases for the position of gs, or None when the
+# position is not in them
+def tablebaseMove(gs):
+    if tablebase is None:
+        return None
+    best = tablebase.bestMove(gs)
+    return None if best is None else best[0]
+
+
+# Turns null move pruning and late move reductions on or off, worker processes are
+# restarted to pick the settings up
+def setSelectivity(nullMove=True, reductions=True):
+    global nullMovePruning, lateMoveReductions
+    nullMovePruning = nullMove
+    lateMoveReductions = reductions
+    closePool()
+    closeSmpPool()
+
+
+# Clears nodes and stats for a new search
+def resetStats():
+    global nodes
+    nodes = 0
+    for name in stats:
+        stats[name] = 0
+
+
+# Adds the stats of a worker process to ours
+def addStats(workerNodes, workerStats):
+    global nodes
+    nodes += workerNodes
+    for name in stats:
+        stats[name] += workerStats[name]
+
+
+# Returns True once the current search has to be abandoned
+def searchStopped():
+    if deadline is not None and time.time() >= deadline:
+        return True
+    if stopTime is not None and time.time() >= stopTime:
+        return True
+    return stopSignal is not None and stopSignal.value != 0
+
 
 # Returns a sorted list of avaliable moves given:
 # gs : gamestate of chessboard
-def getMoves(gs):
-    moves = gs.getValidMoves()
-    underpromotions = []
-    for move in moves:
-        if move.isPawnPromotion:
-            # Append underpromotion to list
-            for piece in ["R", "B", "N"]:
-                newMove = copy.deepcopy(move)
-                newMove.promotedPiece = piece
-                underpromotions.append(newMove)
-
-            move.promotedPiece = "Q"
-
-    moves.extend(underpromotions)
-    return move_ordering(moves, gs)
-
-# Worker function for parallel move evaluation
-def evaluate_move(move, gs_copy, depth, white, a, b):
-    gs_copy.makeMove(move, False)
-    score = -alphabeta(gs_copy, depth - 1, white, -b, -a, -1)
-    gs_copy.undoMove()
-    return (move, score)
-
-# Parallel version using multiprocessing
-def minimax_parallel(gs, depth, white, num_processes=None):
+# hashMove : best move stored in the transposition table, searched first
+def getMoves(gs, hashMove=None):
+    return move_ordering(gs.getValidMoves(), gs, hashMove)
+
+# Long-lived worker pool reused by every parallel search, created on first use
+pool = None
+poolSize = 0
+poolClass = None
+# Best root score found so far, shared between the parent and the workers
+sharedAlpha = None
+# GameState reused by every task of a worker process
+workerState = None
+# Generation of the parent's transposition table in the last task of this worker,
+# a new one means a new search
+workerGeneration = None
+
+
+# Runs once in every worker process
+# stateClass : GameState backend of the searched game (ChessEngine or BitboardEngine)
+def initWorker(alpha, stateClass):
+    global sharedAlpha, workerState
+    sharedAlpha = alpha
+    workerState = stateClass()
+
+
+# Returns the worker pool, (re)creating it when the number of processes or the
+# GameState backend changes
+def getPool(num_processes=None, stateClass=ChessEngine.GameState):
+    global pool, poolSize, poolClass, sharedAlpha
     if num_processes is None:
         num_processes = multiprocessing.cpu_count()
+    if pool is None or poolSize != num_processes or poolClass != stateClass:
+        closePool()
+        sharedAlpha = multiprocessing.Value("d", -math.inf)
+        pool = multiprocessing.Pool(
+            processes=num_processes,
+            initializer=initWorker,
+            initargs=(sharedAlpha, stateClass),
+        )
+        poolSize = num_processes
+        poolClass = stateClass
+    return pool
+
+
+def closePool():
+    global pool, poolSize
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+        pool = None
+        poolSize = 0
+
+
+atexit.register(closePool)
+
+
+# Worker function for parallel move evaluation given:
+# position : compact position from GameState.getPosition
+# move : root move to search
+# b : beta of the root window
+# searchDeadline : deadline of the parent search, or None
+# generation : generation of the parent's transposition table, changes every search
+# Returns (move, score, exact, nodes, stats), score is None if the deadline passed
+# and exact is False when the move failed low against the shared alpha
+def evaluate_move(position, move, depth, white, b, searchDeadline, generation):
+    global deadline, rootPly, workerGeneration
+    if generation != workerGeneration:
+        # the worker's table and move ordering age with the parent's
+        workerGeneration = generation
+        newSearch()
+    resetStats()
+    if searchDeadline is not None and time.time() >= searchDeadline:
+        return (move, None, False, nodes, stats)
+    deadline = searchDeadline
+    workerState.setPosition(position)
+    rootPly = 0
+    workerState.makeMove(move)
+    a = sharedAlpha.value
+    try:
+        score = searchChild(workerState, depth - 1, white, a, b, -1, False)
+    except SearchTimeout:
+        return (move, None, False, nodes, stats)
+    finally:
+        deadline = None
+
+    if score > a:
+        with sharedAlpha.get_lock():
+            if score > sharedAlpha.value:
+                sharedAlpha.value = score
+    return (move, score, score > a, nodes, stats)
 
-    a = -math.inf
-    b = math.inf
-    if gs.checkMate or gs.staleMate or depth == 0:
-        return None
-
-    moves = getMoves(gs)
-    if len(moves) == 0:
-        return None
 
-    # Create copies of game state for each process
-    gs_copies = [copy.deepcopy(gs) for _ in range(len(moves))]
+# Parallel version using multiprocessing
+def minimax_parallel(gs, depth, white, num_processes=None):
+    newSearch()
+    return searchRootParallel(gs, depth, white, num_processes)[0]
 
-    # Use multiprocessing pool to evaluate moves in parallel
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        # Create partial function with fixed parameters
-        eval_func = partial(evaluate_move, gs_copy=gs, depth=depth, white=white, a=a, b=b)
 
-        # Evaluate all moves in parallel
-        results = []
-        for i, move in enumerate(moves):
-            gs_copy = copy.deepcopy(gs)
-            results.append((move, gs_copy))
+# Parallel version of searchRoot. The first move is searched here to set alpha
+# (young brothers wait), the remaining root moves are split over the worker pool
+# and cut off against the best score found so far by any process.
+def searchRootParallel(gs, depth, white, num_processes=None, a=-math.inf, b=math.inf):
+    global rootPly
+    if gs.checkMate or gs.staleMate or depth == 0:
+        return None, 0
+    rootPly = len(gs.undoLog)
 
-        # Map the evaluation function
-        evaluated = pool.starmap(evaluate_move,
-                                [(move, gs_copy, depth, white, a, b)
-                                 for move, gs_copy in results])
+    key = gs.hash
+    entry = transpositionTable.probe(key)
+    hashMove = entry[4] if entry is not None else None
+    moves = getMoves(gs, hashMove)
+    if len(moves) == 0:
+        return None, 0
 
-    # Find best move from results
+    gs.makeMove(moves[0])
+    score = -alphabeta(gs, depth - 1, white, -b, -a, -1)
+    gs.undoMove()
     bestMove = None
-    bestScore = -math.inf
-    for move, score in evaluated:
-        if score > bestScore:
-            bestScore = score
-            bestMove = move
+    if score > a:
+        a = score
+        bestMove = moves[0]
+    if a >= b:
+        transpositionTable.store(key, depth, LOWERBOUND, a, bestMove)
+        return bestMove, a
+
+    if len(moves) > 1:
+        workers = getPool(num_processes, type(gs))
+        sharedAlpha.value = a
+        position = gs.getPosition()
+        generation = transpositionTable.generation
+        evaluated = workers.starmap(
+            evaluate_move,
+            [
+                (position, move, depth, white, b, deadline, generation)
+                for move in moves[1:]
+            ],
+            chunksize=1,
+        )
+
+        timedOut = False
+        for move, score, exact, workerNodes, workerStats in evaluated:
+            addStats(workerNodes, workerStats)
+            if score is None:
+                timedOut = True
+            elif exact and score > a:
+                a = score
+                bestMove = move
+        if timedOut:
+            raise SearchTimeout
+
+    if bestMove is not None:
+        flag = LOWERBOUND if a >= b else EXACT
+        transpositionTable.store(key, depth, flag, min(a, b), bestMove)
+    return bestMove, min(a, b)
 
-    return bestMove
 
 # Returns best move given:
 # gs: game state
 # depth : maximum depth to search through
 # white : 1 if white turn, -1 if black
 def minimax(gs, depth, white):
-    a = -math.inf
-    b = math.inf
+    move = tablebaseMove(gs)
+    if move is not None:
+        return move
+    newSearch()
+    return searchRoot(gs, depth, white)[0]
+
+
+# Searches every root move within the window (a, b) and returns (best move, score),
+# see minimax. The move is None when every move fails low, the score is a lower
+# bound when it reaches b.
+def searchRoot(gs, depth, white, a=-math.inf, b=math.inf):
+    global rootPly
     if gs.checkMate or gs.staleMate or depth == 0:
-        return None
+        return None, 0
+    rootPly = len(gs.undoLog)
+
+    key = gs.hash
+    entry = transpositionTable.probe(key)
+    hashMove = entry[4] if entry is not None else None
 
     bestMove = None
-    for move in getMoves(gs):
-        gs.makeMove(move, False)
-        new_a = -alphabeta(gs, depth - 1, white, -b, -a, -1)
-        if new_a > a:
-            bestMove = move
-            a = new_a
+    for i, move in enumerate(getMoves(gs, hashMove)):
+        gs.makeMove(move)
+        score = searchChild(gs, depth - 1, white, a, b, -1, i == 0)
         gs.undoMove()
+        if score > a:
+            bestMove = move
+            a = score
+            if a >= b:
+                transpositionTable.store(key, depth, LOWERBOUND, a, bestMove)
+                return bestMove, a
+
+    if bestMove is not None:
+        transpositionTable.store(key, depth, EXACT, a, bestMove)
+    return bestMove, a
+
+
+# Returns the score of the move just made, searched depth plies deeper, given the
+# window (a, b) of the parent and side of the child. Moves after the first are
+# principal variation searched: a null window above alpha is enough to prove most
+# of them worse than the best move so far, only those that beat alpha are searched
+# again with the full window.
+def searchChild(gs, depth, white, a, b, side, first):
+    if first or a == -math.inf:
+        return -alphabeta(gs, depth, white, -b, -a, side)
+    score = -alphabeta(gs, depth, white, -a - NULL_WINDOW, -a, side)
+    if a < score < b:
+        score = -alphabeta(gs, depth, white, -b, -a, side)
+    return score
+
+
+# Returns the time in seconds to spend on the next move given either:
+# moveTime : fixed milliseconds per move
+# clock, increment : milliseconds left on the clock and gained per move
+def timeBudget(moveTime=None, clock=None, increment=0):
+    if moveTime is not None:
+        return max(0, moveTime - MOVE_OVERHEAD) / 1000
+    if clock is not None:
+        budget = clock / MOVES_TO_GO + increment
+        return max(0, min(budget, clock - MOVE_OVERHEAD)) / 1000
+    return None
+
+
+# Returns best move found by iterative deepening within a time budget given:
+# gs : game state
+# white : 1 if white turn, -1 if black
+# moveTime : milliseconds per move, or clock and increment in milliseconds
+# maxDepth : depth limit, reached early in simple positions
+# onIteration : optional function called with (depth, score, nodes, seconds, pv)
+#               after every completed iteration
+# parallel : split the root moves over the worker pool, see searchRootParallel
+# Each iteration starts with the previous principal variation, which is kept in the
+# transposition table. The move of the last completed iteration is returned, or a
+# move of the opening book or the tablebases without searching.
+def iterativeDeepening(
+    gs,
+    white,
+    moveTime=None,
+    clock=None,
+    increment=0,
+    maxDepth=64,
+    onIteration=None,
+    parallel=False,
+    num_processes=None,
+):
+    if gs.checkMate or gs.staleMate:
+        return None
+    move = bookMove(gs)
+    if move is None:
+        move = tablebaseMove(gs)
+    if move is not None:
+        return move
+
+    budget = timeBudget(moveTime, clock, increment)
+    searchDeadline = None if budget is None else time.time() + budget
+    resetStats()
+    newSearch()
+    bestMove = deepen(
+        gs, white, searchDeadline, 1, maxDepth, onIteration, parallel, num_processes
+    )[0]
+
+    if bestMove is None:
+        moves = getMoves(gs)
+        if len(moves) > 0:
+            bestMove = moves[0]
+    return bestMove
+
 
+# Runs the iterations of iterativeDeepening from startDepth to maxDepth, stopping at
+# searchDeadline (a time.time() value or None). Returns (best move, score, depth)
+# of the last completed iteration, the move is None if none was completed.
+def deepen(
+    gs,
+    white,
+    searchDeadline,
+    startDepth=1,
+    maxDepth=64,
+    onIteration=None,
+    parallel=False,
+    num_processes=None,
+):
+    global deadline
+    start = time.time()
+    deadline = searchDeadline
+    ply = len(gs.undoLog)
+
+    bestMove, bestScore, bestDepth = None, 0, 0
+    try:
+        for depth in range(startDepth, maxDepth + 1):
+            # Aspiration window around the previous score, widened on a fail
+            window = ASPIRATION_WINDOW
+            if bestMove is None or abs(bestScore) >= MATE_BOUND:
+                a, b = -math.inf, math.inf
+            else:
+                a, b = bestScore - window, bestScore + window
+            while True:
+                if parallel:
+                    move, score = searchRootParallel(
+                        gs, depth, white, num_processes, a, b
+                    )
+                else:
+                    move, score = searchRoot(gs, depth, white, a, b)
+                if (move is not None and a < score < b) or (
+                    a == -math.inf and b == math.inf
+                ):
+                    break
+                window *= ASPIRATION_GROWTH
+                if window > ASPIRATION_MAX:
+                    a, b = -math.inf, math.inf
+                elif move is None:
+                    a = score - window
+                else:
+                    b = score + window
+            if move is None:
+                break
+            bestMove, bestScore, bestDepth = move, score, depth
+            elapsed = time.time() - start
+            if onIteration is not None:
+                onIteration(depth, score, nodes, elapsed, principalVariation(gs, depth))
+            # Stop once a forced mate is found
+            if abs(score) >= MATE_BOUND:
+                break
+            # The next iteration would most likely not finish in time
+            if deadline is not None and elapsed >= (deadline - start) / 2:
+                break
+    except SearchTimeout:
+        # Take back the moves of the unfinished search
+        while len(gs.undoLog) > ply:
+            if gs.lastMove() == NULL_MOVE:
+                gs.undoNullMove()
+            else:
+                gs.undoMove()
+    finally:
+        deadline = None
+
+    return bestMove, bestScore, bestDepth
+
+
+# Lazy SMP: helper processes search the same root as the parent at staggered
+# depths and only communicate through sharedTable
+smpPool = None
+smpThreads = 0
+smpClass = None
+sharedTable = None
+# Value of the parent telling the helpers to stop (helpers see it as stopSignal)
+smpStop = None
+
+
+# Runs once in every Lazy SMP helper process
+def initSmpWorker(tableName, tableSize, stop, stateClass):
+    global transpositionTable, stopSignal, workerState
+    transpositionTable = SharedTranspositionTable(name=tableName, size=tableSize)
+    stopSignal = stop
+    workerState = stateClass()
+
+
+# Returns the Lazy SMP helper pool, (re)creating it and the shared table when the
+# number of threads, the table size or the GameState backend changes
+def getSmpPool(threads, sizeMb, stateClass=ChessEngine.GameState):
+    global smpPool, smpThreads, smpClass, sharedTable, smpStop
+    if (
+        sharedTable is None
+        or smpThreads != threads
+        or sharedTable.sizeMb != sizeMb
+        or smpClass != stateClass
+    ):
+        closeSmpPool()
+        sharedTable = SharedTranspositionTable(sizeMb)
+        smpStop = multiprocessing.Value("b", 0)
+        if threads > 1:
+            smpPool = multiprocessing.Pool(
+                processes=threads - 1,
+                initializer=initSmpWorker,
+                initargs=(sharedTable.name, sharedTable.size, smpStop, stateClass),
+            )
+        smpThreads = threads
+        smpClass = stateClass
+    return smpPool
+
+
+def closeSmpPool():
+    global smpPool, smpThreads, sharedTable
+    if smpPool is not None:
+        smpPool.terminate()
+        smpPool.join()
+        smpPool = None
+    if sharedTable is not None:
+        sharedTable.close()
+        sharedTable = None
+    smpThreads = 0
+
+
+atexit.register(closeSmpPool)
+
+
+# Helper search of lazySmp, returns (move, score, depth, nodes, stats). position
+# carries the repetition counts of the game, a helper blind to a repetition would
+# override the main search whenever it completes a deeper iteration.
+def smpWorker(position, white, searchDeadline, startDepth, maxDepth, generation):
+    resetStats()
+    transpositionTable.generation = generation
+    resetOrdering()
+    workerState.setPosition(position)
+    move, score, depth = deepen(
+        workerState, white, searchDeadline, startDepth, maxDepth
+    )
+    return (move, score, depth, nodes, stats)
+
+
+# Returns best move found by a Lazy SMP search given:
+# threads : number of processes searching, including this one
+# sizeMb : memory cap of the shared transposition table
+# other arguments as iterativeDeepening
+# Every process runs its own iterative deepening on the same root, half of the
+# helpers one ply ahead. The move of the deepest completed iteration is returned.
+def lazySmp(
+    gs,
+    white,
+    moveTime=None,
+    clock=None,
+    increment=0,
+    maxDepth=64,
+    onIteration=None,
+    threads=None,
+    sizeMb=64,
+):
+    global transpositionTable
+    if gs.checkMate or gs.staleMate:
+        return None
+    move = bookMove(gs)
+    if move is None:
+        move = tablebaseMove(gs)
+    if move is not None:
+        return move
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+
+    helpers = getSmpPool(threads, sizeMb, type(gs))
+    budget = timeBudget(moveTime, clock, increment)
+    searchDeadline = None if budget is None else time.time() + budget
+    sharedTable.newSearch()
+    resetOrdering()
+    smpStop.value = 0
+
+    pending = []
+    if helpers is not None:
+        position = gs.getPosition()
+        for i in range(threads - 1):
+            startDepth = 2 if i % 2 == 0 else 1
+            pending.append(
+                helpers.apply_async(
+                    smpWorker,
+                    (
+                        position,
+                        white,
+                        searchDeadline,
+                        startDepth,
+                        maxDepth,
+                        sharedTable.generation,
+                    ),
+                )
+            )
+
+    localTable = transpositionTable
+    transpositionTable = sharedTable
+    resetStats()
+    try:
+        move, score, depth = deepen(gs, white, searchDeadline, 1, maxDepth, onIteration)
+    finally:
+        transpositionTable = localTable
+        smpStop.value = 1
+
+    bestMove, bestDepth = (move, depth) if move is not None else (None, 0)
+    for result in pending:
+        move, score, depth, helperNodes, helperStats = result.get()
+        addStats(helperNodes, helperStats)
+        if move is not None and depth > bestDepth:
+            bestMove, bestDepth = move, depth
+
+    if bestMove is None:
+        moves = getMoves(gs)
+        if len(moves) > 0:
+            bestMove = moves[0]
     return bestMove
 
+
+# Returns the principal variation stored in the transposition table given:
+# gs : game state
+# depth : maximum length of the variation
+def principalVariation(gs, depth):
+    pv = []
+    for i in range(depth):
+        entry = transpositionTable.probe(gs.hash)
+        if entry is None or entry[4] is None:
+            break
+        moves = getMoves(gs, entry[4])
+        if len(moves) == 0 or moves[0] != entry[4]:
+            break
+        move = moves[0]
+        gs.makeMove(move)
+        pv.append(move)
+    for move in pv:
+        gs.undoMove()
+    return pv
+
+
+# Mate and tablebase scores count plies from the root while the transposition table
+# counts them from the stored position, so an entry stays right at any ply
+def scoreToTable(score, ply):
+    if score >= Tablebase.TABLEBASE_SCORE_MIN:
+        return score + ply
+    if score <= -Tablebase.TABLEBASE_SCORE_MIN:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score >= Tablebase.TABLEBASE_SCORE_MIN:
+        return score - ply
+    if score <= -Tablebase.TABLEBASE_SCORE_MIN:
+        return score + ply
+    return score
+
 # Returns score of given gamestate through alpha beta negamax:
 # gs: game state
 # depth : maximum depth to search through
@@ -104,102 +686,273 @@ def minimax(gs, depth, white):
 # side: 1 if our turn, -1 if enemy turn
 
 def alphabeta(gs, depth, white, a, b, side):
-    # Set checkmate/stalemate flags
-    terminal, winner = isCheckmate(gs)
-    if terminal:
-        if winner == 0:
-            return 0
-        else:
-            return white * side * winner * (10000 + 100 * depth)
+    global nodes
+    nodes += 1
+    if nodes & 63 == 0 and searchStopped():
+        raise SearchTimeout
+
+    # A position seen before can be repeated again, so the side that would do
+    # better elsewhere will avoid it and the other side can hold the draw. Nothing
+    # is left to play for either once the fifty move rule applies, unless its last
+    # move gave checkmate, which takes precedence.
+    if gs.repetitionCount() >= 2:
+        return 0
+    ply = len(gs.undoLog) - rootPly
+    if gs.halfmove >= 100:
+        if gs.kingInCheck() and len(gs.getValidMoves()) == 0:
+            return -(MATE - ply)
+        return 0
+
+    # Look up previous results of this position
+    key = gs.hash
+    hashMove = None
+    entry = transpositionTable.probe(key)
+    if entry is not None:
+        _, entryDepth, flag, score, hashMove, _ = entry
+        score = scoreFromTable(score, ply)
+        if entryDepth >= depth:
+            if flag == EXACT:
+                return score
+            elif flag == LOWERBOUND:
+                a = max(a, score)
+            elif flag == UPPERBOUND:
+                b = min(b, score)
+            if a >= b:
+                return score
+
+    # Small endings are known exactly
+    if tablebase is not None:
+        value = tablebase.probe(gs)
+        if value is not None and value != Tablebase.INVALID:
+            # table values count plies from this position too
+            return scoreFromTable(Tablebase.scoreOf(value), ply)
 
     if depth == 0:
-        return white * side * gs.evaluate()
+        return quiescence(gs, white, a, b, side)
+
+    # Null move pruning, not in check, not twice in a row and not when the side to
+    # move has only pawns left, where passing may really be the best move (zugzwang)
+    if (
+        nullMovePruning
+        and depth >= NULL_MOVE_MIN_DEPTH
+        and abs(b) < MATE_BOUND
+        and gs.lastMove() != NULL_MOVE
+        and gs.pieceCount["w" if gs.whiteTurn else "b"] > 0
+        and white * side * gs.evaluate() >= b
+        and not gs.kingInCheck()
+    ):
+        # a timeout leaves the null move on the undo log like any other move, for
+        # deepen to take back
+        gs.makeNullMove()
+        score = -alphabeta(
+            gs,
+            depth - 1 - NULL_MOVE_REDUCTION,
+            white,
+            -b,
+            -b + NULL_WINDOW,
+            -side,
+        )
+        gs.undoNullMove()
+        if score >= b:
+            stats["nullMoveCutoffs"] += 1
+            return b
+
+    # Checkmate and stalemate are found from the move list the search needs anyway
+    moves = getMoves(gs, hashMove)
+    if len(moves) == 0:
+        return -(MATE - ply) if gs.inCheck else 0
 
-    for move in getMoves(gs):
-        gs.makeMove(move, False)
-        a = max(a, -alphabeta(gs, depth - 1, white, -b, -a, -side))
+    inCheck = gs.inCheck
+    a_orig = a
+    bestMove = None
+    for i, move in enumerate(moves):
+        gs.makeMove(move)
+        # Late move reduction of quiet moves that don't give check
+        if (
+            lateMoveReductions
+            and i >= LMR_MOVES
+            and depth >= LMR_MIN_DEPTH
+            and not inCheck
+            and not (move >> 12) & (CAPTURE | PROMOTION)
+            and not gs.kingInCheck()
+        ):
+            stats["reductions"] += 1
+            reduction = 1 if i < LMR_LATE_MOVES else 2
+            score = -alphabeta(
+                gs, depth - 1 - reduction, white, -a - NULL_WINDOW, -a, -side
+            )
+            if score > a:
+                stats["reSearches"] += 1
+                score = searchChild(gs, depth - 1, white, a, b, -side, False)
+        else:
+            score = searchChild(gs, depth - 1, white, a, b, -side, i == 0)
         gs.undoMove()
+        if score > a:
+            a = score
+            bestMove = move
         if a >= b:
+            transpositionTable.store(
+                key, depth, LOWERBOUND, scoreToTable(a, ply), move
+            )
+            if not (move >> 12) & (CAPTURE | PROMOTION):
+                recordCutoff(gs, move, depth)
             return a
+
+    if bestMove is None:
+        transpositionTable.store(
+            key, depth, UPPERBOUND, scoreToTable(a_orig, ply), None
+        )
+    else:
+        transpositionTable.store(key, depth, EXACT, scoreToTable(a, ply), bestMove)
     return a
 
-# sorts the moves first according to captures, then checks, then rest, given :
-# moves : list of moves to sort
-# gs : gamestate
-def move_ordering(moves, gs):
-    # Captures
-    ordered = []
-    for move in moves:
-        if move.pieceCaptured != "--":
-            ordered.append(move)
-
-    for move in ordered:
-        moves.remove(move)
-
-    # Checks
-    checks = []
-    for move in moves:
-        gs.makeMove(move, False)
-        if gs.inCheck:
-            checks.append(move)
+# Piece values used for capture ordering and delta pruning
+PIECE_VALUES = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 0}
+# A capture is skipped when even winning the piece plus this margin can't raise alpha
+DELTA_MARGIN = 2
+
+
+# Returns the value of the piece a move captures, 0 if it captures nothing
+def captureValue(gs, move):
+    flags = move >> 12
+    if not flags & CAPTURE:
+        return 0
+    if flags == EN_PASSANT:
+        return PIECE_VALUES["p"]
+    end = (move >> 6) & 63
+    return PIECE_VALUES[gs.board[end >> 3][end & 7][1]]
+
+
+# Returns the value of the piece making a move
+def moverValue(gs, move):
+    start = move & 63
+    return PIECE_VALUES[gs.board[start >> 3][start & 7][1]]
+
+
+# Returns score of given gamestate once it is quiet, searching only captures and
+# promotions from the leaves of alphabeta (all moves when in check), given the
+# same arguments as alphabeta. The side to move may stand pat on the static
+# evaluation instead of capturing.
+def quiescence(gs, white, a, b, side):
+    global nodes
+    nodes += 1
+    if nodes & 63 == 0 and searchStopped():
+        raise SearchTimeout
+
+    # Standing pat is tested before generating moves, most quiescence nodes end
+    # there. A stalemate scoring above beta is missed, which the main search sees.
+    inCheck = gs.kingInCheck()
+    if not inCheck:
+        standPat = white * side * gs.evaluate()
+        if standPat >= b:
+            return standPat
+
+    moves = gs.getValidMoves()
+    if len(moves) == 0:
+        return -(MATE - (len(gs.undoLog) - rootPly)) if inCheck else 0
+
+    if inCheck:
+        # Every evasion has to be searched, standing pat is not an option in check
+        standPat = -math.inf
+        tactical = moves
+    else:
+        a = max(a, standPat)
+        # captures and queen promotions
+        tactical = [
+            move
+            for move in moves
+            if (move >> 12) & CAPTURE
+            or (move >> 12) & QUEEN_PROMOTION == QUEEN_PROMOTION
+        ]
+
+    # Most valuable victim first, least valuable attacker as tie break
+    tactical.sort(
+        key=lambda move: moverValue(gs, move) - 10 * captureValue(gs, move)
+        if (move >> 12) & CAPTURE
+        else 0
+    )
+    for move in tactical:
+        if (move >> 12) & PROMOTION:
+            gain = PIECE_VALUES["Q"] - 1
+        else:
+            gain = 0
+        gain += captureValue(gs, move)
+
+        # Delta pruning
+        if not inCheck and standPat + gain + DELTA_MARGIN <= a:
+            continue
+
+        gs.makeMove(move)
+        score = -quiescence(gs, white, -b, -a, -side)
         gs.undoMove()
+        if score > a:
+            a = score
+            if a >= b:
+                return a
+    return a
 
-    for move in checks:
-        moves.remove(move)
-        ordered.append(move)
 
-    # Put rest of moves
-    for move in moves:
-        ordered.append(move)
+# Ordering scores: hash move, then captures and queen promotions by MVV-LVA, then
+# killer moves, then quiet moves by history, then underpromotions
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000
+KILLER_SCORES = (90000, 89000)
+HISTORY_MAX = 80000
 
-    return ordered
+# Two quiet moves per ply of the game that caused a beta cutoff, and how often each
+# quiet move (by side, start and end square) caused one
+killers = {}
+history = [0] * (2 * 64 * 64)
 
 
-# Checks if is checkmate (it is moved out from chess engine so it doesnt have to
-# run the whole function it is taken from)
-# self : gamestate
-def isCheckmate(self):
-    moves = []
-    self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-    if self.whiteTurn:
-        kingRow = self.whiteKingLocation[0]
-        kingCol = self.whiteKingLocation[1]
-    else:
-        kingRow = self.blackKingLocation[0]
-        kingCol = self.blackKingLocation[1]
-
-    if self.inCheck:
-        if len(self.checks) == 1:
-            moves = self.getAllPossibleMoves()
-            check = self.checks[0]
-            checkRow = check[0]
-            checkCol = check[1]
-            pieceChecking = self.board[checkRow][checkCol]
-            validSqs = []
-            if pieceChecking[1] == "N":
-                validSqs = [(checkRow, checkCol)]
-            else:
-                for i in range(1, 8):
-                    validSq = (kingRow + check[2] * i, kingCol + check[3] * i)
-                    validSqs.append(validSq)
-                    if validSq[0] == checkRow and validSq[1] == checkCol:
-                        break
-            for i in range(len(moves) - 1, -1, -1):
-                if moves[i].pieceMoved[1] != "K":
-                    if not (moves[i].endRow, moves[i].endCol) in validSqs:
-                        moves.remove(moves[i])
-        else:
-            self.KingMoves(kingRow, kingCol, moves)
-    else:
-        moves = self.getAllPossibleMoves()
+# Starts a new search: ages the transposition table and the ordering heuristics
+def newSearch():
+    transpositionTable.newSearch()
+    resetOrdering()
+
+
+def resetOrdering():
+    killers.clear()
+    for i in range(len(history)):
+        history[i] >>= 1
 
-    if len(moves) == 0:
-        if self.inCheck:
-            if not self.whiteTurn:
-                return True, 1
-            else:
-                return True, -1
-        else:
-            return True, 0
 
-    return False, 0
+# Remembers a quiet move that caused a beta cutoff in the current position
+def recordCutoff(gs, move, depth):
+    slots = killers.get(len(gs.undoLog))
+    if slots is None:
+        killers[len(gs.undoLog)] = [move, None]
+    elif slots[0] != move:
+        slots[1] = slots[0]
+        slots[0] = move
+
+    index = (0 if gs.whiteTurn else 4096) + (move & 0xFFF)
+    history[index] = min(HISTORY_MAX, history[index] + depth * depth)
+
+
+# sorts the moves in one scoring pass without making them, given :
+# moves : list of moves to sort
+# gs : gamestate
+# hashMove : transposition table move, searched first
+def move_ordering(moves, gs, hashMove=None):
+    killerMoves = killers.get(len(gs.undoLog), ())
+    side = 0 if gs.whiteTurn else 4096
+
+    def score(move):
+        if move == hashMove:
+            return HASH_MOVE_SCORE
+        flags = move >> 12
+        queenPromotion = flags & QUEEN_PROMOTION == QUEEN_PROMOTION
+        if queenPromotion or flags & CAPTURE:
+            victim = captureValue(gs, move)
+            if queenPromotion:
+                victim += PIECE_VALUES["Q"]
+            return CAPTURE_SCORE + 10 * victim - moverValue(gs, move)
+        if flags & PROMOTION:
+            return -1
+        if move in killerMoves:
+            return KILLER_SCORES[killerMoves.index(move)]
+        return history[side + (move & 0xFFF)]
+
+    moves.sort(key=score, reverse=True)
+    return moves
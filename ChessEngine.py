@@ -1,6 +1,184 @@
 # Storing the information about the current state of a chess game and determine the valid moves at the current state.
-import copy
+import re
 import ZobristHash as hash
+from TranspositionTable import PawnHashTable
+
+PIECE_VALUE = {
+    "bp": -1,
+    "bR": -5,
+    "bN": -3,
+    "bB": -3,
+    "bQ": -9,
+    "bK": 0,
+    "wp": 1,
+    "wR": 5,
+    "wN": 3,
+    "wB": 3,
+    "wQ": 9,
+    "wK": 0,
+    "--": 0,
+}
+
+
+# Returns, in thousandths of a pawn, every evaluation term that only depends on a
+# piece and its square: material, centre pawns, space, development and knights on
+# the edge
+def pieceSquareScore(piece, row, col):
+    score = PIECE_VALUE[piece] * 1000
+    sign = 1 if piece[0] == "w" else -1
+    if piece[1] == "p":
+        # centre
+        if 2 <= row <= 5 and 3 <= col <= 4:
+            score += sign * 200
+        # space, weighted 0.05
+        if piece[0] == "w":
+            score += 25 * (7 - row) + (500 if row == 1 else 0)
+        else:
+            score -= 25 * row + (500 if row == 6 else 0)
+    else:
+        # development
+        if piece[1] != "K" and piece[1] != "R":
+            if (piece[0] == "w" and row < 6) or (piece[0] == "b" and row > 1):
+                score += sign * 150
+        elif piece[1] == "R" and 3 <= col <= 6:
+            score += sign * 150
+        # Knight on edge case
+        if piece[1] == "N" and col in (0, 7):
+            score -= sign * 50
+    return score
+
+
+PIECE_SQUARE = {
+    piece: [[pieceSquareScore(piece, row, col) for col in range(8)] for row in range(8)]
+    for piece in PIECE_VALUE
+    if piece != "--"
+}
+
+# Pawn structure scores shared by every GameState of this process
+pawnTable = PawnHashTable()
+
+# Penalty for moving the queen out early, only counted in the first 12 half moves
+EARLY_QUEEN = {
+    "wQ": [[-250 if 2 <= row <= 5 else 0 for col in range(8)] for row in range(8)],
+    "bQ": [[250 if 2 <= row <= 5 else 0 for col in range(8)] for row in range(8)],
+}
+
+# Moves are 16 bit ints: start square (row * 8 + col) in bits 0-5, end square in
+# bits 6-11 and one of these flags in bits 12-15
+QUIET = 0
+DOUBLE_PUSH = 1
+KING_CASTLE = 2
+QUEEN_CASTLE = 3
+CAPTURE = 4  # bit shared by en passant and capturing promotions
+EN_PASSANT = 5
+PROMOTION = 8  # plus the index of the new piece in PROMOTION_PIECES
+PROMOTION_PIECES = "NBRQ"
+
+# Castling rights bits of GameState.castle, the same masks ZobristHash keys
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+# Rights left after a move from or to a square: moving the king or a rook, or
+# capturing a rook, loses the rights that depend on it
+CASTLE_KEEP = [15] * 64
+CASTLE_KEEP[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLE_KEEP[63] = 15 & ~WHITE_KINGSIDE
+CASTLE_KEEP[56] = 15 & ~WHITE_QUEENSIDE
+CASTLE_KEEP[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLE_KEEP[7] = 15 & ~BLACK_KINGSIDE
+CASTLE_KEEP[0] = 15 & ~BLACK_QUEENSIDE
+
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (1, 1), (1, -1), (-1, 1))
+KNIGHT_DIRECTIONS = (
+    (-2, -1),
+    (-1, -2),
+    (1, -2),
+    (2, -1),
+    (2, 1),
+    (1, 2),
+    (-1, 2),
+    (-2, 1),
+)
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+# Returns the (row, col) squares reached by stepping once in each direction from sq
+def stepTargets(sq, directions):
+    row, col = divmod(sq, 8)
+    return tuple(
+        (row + d[0], col + d[1])
+        for d in directions
+        if 0 <= row + d[0] < 8 and 0 <= col + d[1] < 8
+    )
+
+
+# Returns the (row, col) squares after sq in direction d up to the edge, nearest
+# first
+def raySquares(sq, d):
+    row, col = divmod(sq, 8)
+    squares = []
+    row += d[0]
+    col += d[1]
+    while 0 <= row < 8 and 0 <= col < 8:
+        squares.append((row, col))
+        row += d[0]
+        col += d[1]
+    return tuple(squares)
+
+
+# Lookup tables of the list based generator indexed by square (row * 8 + col), so
+# generating moves needs no direction arithmetic or bounds checks
+KNIGHT_TARGETS = [stepTargets(sq, KNIGHT_DIRECTIONS) for sq in range(64)]
+KING_TARGETS = [stepTargets(sq, KING_DIRECTIONS) for sq in range(64)]
+# (direction, squares) of every direction that doesn't start at the edge
+ROOK_RAYS = [
+    tuple((d, raySquares(sq, d)) for d in ROOK_DIRECTIONS if raySquares(sq, d))
+    for sq in range(64)
+]
+BISHOP_RAYS = [
+    tuple((d, raySquares(sq, d)) for d in BISHOP_DIRECTIONS if raySquares(sq, d))
+    for sq in range(64)
+]
+# BETWEEN[a][b] : squares strictly between a and b on a shared line, otherwise ()
+BETWEEN = [[()] * 64 for sq in range(64)]
+for start in range(64):
+    for d in KING_DIRECTIONS:
+        ray = raySquares(start, d)
+        for i, (row, col) in enumerate(ray):
+            BETWEEN[start][row * 8 + col] = ray[:i]
+
+# Tokens of the operations of an EPD record: quoted strings, semicolons and words
+EPD_TOKEN = re.compile(r'"[^"]*"|;|[^\s;"]+')
+QUEEN_PROMOTION = PROMOTION | 3
+MOVE_MASK = 0xFFFF
+
+# The move log stores each move with the piece moved in bits 16-19 and the piece
+# captured in bits 20-23, as indexes into PIECES
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK", "--")
+PIECE_CODE = {piece: code for code, piece in enumerate(PIECES)}
+# Move log entry of a null move (the side to move passes), see makeNullMove
+NULL_MOVE = (PIECE_CODE["--"] << 16) | (PIECE_CODE["--"] << 20)
+
+
+def encodeMove(startRow, startCol, endRow, endCol, flags=QUIET):
+    return (startRow * 8 + startCol) | ((endRow * 8 + endCol) << 6) | (flags << 12)
+
+
+# Returns a move in long algebraic notation, e.g. e2e4 or e7e8q
+def moveNotation(move):
+    startRow, startCol = divmod(move & 63, 8)
+    endRow, endCol = divmod((move >> 6) & 63, 8)
+    notation = (
+        Move.colToAlpha[startCol]
+        + Move.rowToRank[startRow]
+        + Move.colToAlpha[endCol]
+        + Move.rowToRank[endRow]
+    )
+    if (move >> 12) & PROMOTION:
+        notation += PROMOTION_PIECES[(move >> 12) & 3].lower()
+    return notation
 
 
 class GameState:
@@ -26,190 +204,484 @@ class GameState:
             "K": self.KingMoves,
             "Q": self.QueenMoves,
         }
-        self.pieceValue = {
-            "bp": -1,
-            "bR": -5,
-            "bN": -3,
-            "bB": -3,
-            "bQ": -9,
-            "bK": 0,
-            "wp": 1,
-            "wR": 5,
-            "wN": 3,
-            "wB": 3,
-            "wQ": 9,
-            "wK": 0,
-            "--": 0,
-        }
-        self.zobrist = hash.initTable()
+        self.pieceValue = PIECE_VALUE
+        self.zobrist = hash.ZobristTable
         self.whiteTurn = True
-        self.moveLog = []
-        self.hashLog = [hash.initHash(self.board, self.zobrist)]
+        # number of half moves played before the position the game was set up from
+        self.startPly = 0
+        # half moves since the last capture or pawn move, for the fifty move rule
+        self.halfmove = 0
         self.whiteKingLocation = (7, 4)
         self.blackKingLocation = (0, 4)
         self.inCheck = False
         self.checkMate = False
         self.staleMate = False
         self.enpassant = ()
-        self.enpassantLog = [self.enpassant]
         self.pins = []
         self.checks = []
-        self.currentCastleRight = castleRight(True, True, True, True)
-        self.castleRightLog = [
-            castleRight(
-                self.currentCastleRight.wK,
-                self.currentCastleRight.wQ,
-                self.currentCastleRight.bK,
-                self.currentCastleRight.bQ,
-            )
-        ]
+        # squares attacked by the opponent, filled by getValidMoves
+        self.attacked = bytearray(64)
+        # castling rights mask, see WHITE_KINGSIDE
+        self.castle = 15
+        # zobrist hash of the current position
+        self.hash = hash.initHash(
+            self.board, self.zobrist, self.whiteTurn, self.castle, self.enpassant
+        )
+        # One record per move played: (move log entry, castle, enpassant, hash,
+        # halfmove) with the state from before the move, restored by undoMove
+        self.undoLog = []
+        # How often each position occurred since the halfmove clock was last reset,
+        # none of the earlier ones can come back. One dict per reset.
+        self.repetitionLog = [{self.hash: 1}]
+        self.initEvaluation()
+
+    # Returns the current position as a compact tuple that is cheap to pickle:
+    # (64 squares joined into a string, whiteTurn, castling mask, enpassant, ply,
+    # halfmove clock, repetition counts since the clock was reset)
+    # The repetition counts let a search started from the tuple see repetitions of
+    # the game played so far.
+    def getPosition(self):
+        return (
+            "".join("".join(row) for row in self.board),
+            self.whiteTurn,
+            self.castle,
+            self.enpassant,
+            self.startPly + len(self.undoLog),
+            self.halfmove,
+            dict(self.repetitionLog[-1]),
+        )
 
-    def makeMove(self, move, humanTurn):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append(move)  # store history of move
-        self.hashLog.append(hash.hashMove(move, self.hashLog[-1], self.zobrist))
+    # Sets up the position returned by getPosition, clearing the move history but
+    # keeping its repetition counts (None when the position has no history)
+    def setPosition(self, position):
+        squares, whiteTurn, castle, enpassant, ply, halfmove, repetitions = position
+        self.board = [
+            [squares[i : i + 2] for i in range(row * 16, row * 16 + 16, 2)]
+            for row in range(8)
+        ]
+        for row in range(8):
+            for col in range(8):
+                if self.board[row][col] == "wK":
+                    self.whiteKingLocation = (row, col)
+                elif self.board[row][col] == "bK":
+                    self.blackKingLocation = (row, col)
+        self.whiteTurn = whiteTurn
+        self.startPly = ply
+        self.halfmove = halfmove
+        self.inCheck = False
+        self.checkMate = False
+        self.staleMate = False
+        self.enpassant = enpassant
+        self.pins = []
+        self.checks = []
+        self.castle = castle
+        self.hash = hash.initHash(
+            self.board, self.zobrist, self.whiteTurn, castle, enpassant
+        )
+        self.undoLog = []
+        if repetitions is None:
+            self.repetitionLog = [{self.hash: 1}]
+        else:
+            # copied, the tuple may set up several games
+            self.repetitionLog = [dict(repetitions)]
+        self.initEvaluation()
+
+    # Sets up the position of a FEN string, clearing the move history
+    def setFen(self, fen):
+        fields = fen.split()
+        rows = fields[0].split("/") if len(fields) > 0 else []
+        if len(rows) != 8:
+            raise ValueError("FEN board needs 8 rows: " + fen)
+        squares = ""
+        for rowText in rows:
+            rowSquares = ""
+            for char in rowText:
+                if char.isdigit():
+                    rowSquares += "--" * int(char)
+                elif char.upper() in "PNBRQK":
+                    color = "w" if char.isupper() else "b"
+                    rowSquares += color + ("p" if char in "pP" else char.upper())
+                else:
+                    raise ValueError("Invalid FEN piece " + char + ": " + fen)
+            if len(rowSquares) != 16:
+                raise ValueError("FEN row needs 8 squares: " + rowText)
+            squares += rowSquares
+        # boards the move generators can't play from
+        pieces = [squares[i : i + 2] for i in range(0, 128, 2)]
+        if pieces.count("wK") != 1 or pieces.count("bK") != 1:
+            raise ValueError("FEN needs one king of each color: " + fen)
+        if any(piece[1] == "p" for piece in pieces[:8] + pieces[56:]):
+            raise ValueError("FEN has a pawn on the first or last rank: " + fen)
+
+        whiteTurn = len(fields) < 2 or fields[1] == "w"
+        castle = 0
+        if len(fields) > 2:
+            for char in fields[2]:
+                castle |= {"K": 1, "Q": 2, "k": 4, "q": 8}.get(char, 0)
+        # a right is lost once its king or rook has left its square
+        for right, color, kingSquare, rookSquare in (
+            (WHITE_KINGSIDE, "w", 60, 63),
+            (WHITE_QUEENSIDE, "w", 60, 56),
+            (BLACK_KINGSIDE, "b", 4, 7),
+            (BLACK_QUEENSIDE, "b", 4, 0),
+        ):
+            if pieces[kingSquare] != color + "K" or pieces[rookSquare] != color + "R":
+                castle &= ~right
+        enpassant = ()
+        if len(fields) > 3 and fields[3] != "-":
+            square = fields[3]
+            if len(square) != 2 or square[0] not in "abcdefgh" or square[1] not in "36":
+                raise ValueError("Invalid FEN en passant square " + square)
+            enpassant = (Move.rankToRow[square[1]], Move.alphaToCol[square[0]])
+        halfmove = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+        ply = 2 * (fullmove - 1) + (0 if whiteTurn else 1)
+        self.setPosition(
+            (squares, whiteTurn, castle, enpassant, ply, halfmove, None)
+        )
+        # the king of the side that just moved can't be left in check
         self.whiteTurn = not self.whiteTurn
+        illegal = self.kingInCheck()
+        self.whiteTurn = not self.whiteTurn
+        if illegal:
+            raise ValueError("FEN side not to move is in check: " + fen)
+
+    # Returns the FEN string of the current position
+    def getFen(self):
+        return " ".join(
+            (
+                self.getEpdPosition(),
+                str(self.halfmove),
+                str((self.startPly + len(self.undoLog)) // 2 + 1),
+            )
+        )
 
-        # update king's location
-        if move.pieceMoved == "wK":
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        if move.pieceMoved == "bK":
-            self.blackKingLocation = (move.endRow, move.endCol)
+    # Returns the first four FEN fields: board, side to move, castling rights and
+    # en passant square
+    def getEpdPosition(self):
+        rows = []
+        for row in self.board:
+            text = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty > 0:
+                    text += str(empty)
+                    empty = 0
+                letter = "P" if piece[1] == "p" else piece[1]
+                text += letter if piece[0] == "w" else letter.lower()
+            rows.append(text + (str(empty) if empty > 0 else ""))
+
+        rights = ""
+        for right, letter in (
+            (WHITE_KINGSIDE, "K"),
+            (WHITE_QUEENSIDE, "Q"),
+            (BLACK_KINGSIDE, "k"),
+            (BLACK_QUEENSIDE, "q"),
+        ):
+            if self.castle & right:
+                rights += letter
+
+        enpassant = "-"
+        if self.enpassant != ():
+            enpassant = Move.colToAlpha[self.enpassant[1]]
+            enpassant += Move.rowToRank[self.enpassant[0]]
+        return " ".join(
+            ("/".join(rows), "w" if self.whiteTurn else "b", rights or "-", enpassant)
+        )
 
-        # promotion
-        if move.isPawnPromotion:
-            if humanTurn:
-                promotedPiece = input(
-                    "Enter the piece you want to promote to (Q, R, B, N): "
-                )
-                promotedPiece = promotedPiece.upper()
-                self.board[move.endRow][move.endCol] = (
-                    move.pieceMoved[0] + promotedPiece
-                )
+    # Sets up the position of an EPD record and returns its operations as a dict of
+    # opcode : list of operands, quotes removed. The hmvc and fmvn operations set
+    # the move counters.
+    def setEpd(self, epd):
+        fields = epd.split(None, 4)
+        if len(fields) < 4:
+            raise ValueError("EPD needs 4 position fields: " + epd)
+        operations = {}
+        opcode = None
+        for token in EPD_TOKEN.findall(fields[4] if len(fields) > 4 else ""):
+            if token == ";":
+                opcode = None
+            elif opcode is None:
+                opcode = token
+                operations[opcode] = []
             else:
-                self.board[move.endRow][move.endCol] = (
-                    move.pieceMoved[0] + move.promotedPiece
-                )
+                operations[opcode].append(token.strip('"'))
+
+        halfmove = operations.get("hmvc", ["0"])[0]
+        fullmove = operations.get("fmvn", ["1"])[0]
+        self.setFen(" ".join(fields[:4] + [halfmove, fullmove]))
+        return operations
+
+    # Returns the EPD record of the current position with the operations given as a
+    # dict of opcode : operand or list of operands
+    def getEpd(self, operations=None):
+        epd = self.getEpdPosition()
+        for opcode, operands in (operations or {}).items():
+            if isinstance(operands, str):
+                operands = [operands]
+            epd += " " + opcode
+            for operand in operands:
+                if operand == "" or any(char in operand for char in ' ;"'):
+                    operand = '"' + operand.replace('"', "") + '"'
+                epd += " " + operand
+            epd += ";"
+        return epd
+
+    # Returns the legal move written in standard algebraic notation (e.g. Nbd7,
+    # exd6, e8=Q+, O-O), raises ValueError if it is illegal or ambiguous
+    def parseSan(self, san):
+        text = san.rstrip("+#!?")
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            flag = KING_CASTLE if len(text) == 3 else QUEEN_CASTLE
+            for move in self.getValidMoves():
+                if move >> 12 == flag:
+                    return move
+            raise ValueError("Illegal move " + san)
+
+        promotion = ""
+        if "=" in text:
+            text, promotion = text.split("=", 1)
+        elif len(text) > 2 and text[0].islower() and text[-1] in PROMOTION_PIECES:
+            text, promotion = text[:-1], text[-1]
+        piece = text[0] if text[0] in "NBRQK" else "p"
+        text = text.replace("x", "")
+        if piece != "p":
+            text = text[1:]
+        if (
+            len(text) < 2
+            or text[-2] not in Move.alphaToCol
+            or text[-1] not in Move.rankToRow
+        ):
+            raise ValueError("Invalid move " + san)
+        end = Move.rankToRow[text[-1]] * 8 + Move.alphaToCol[text[-2]]
+        disambiguation = text[:-2]
+
+        candidates = []
+        for move in self.getValidMoves():
+            if (move >> 6) & 63 != end:
+                continue
+            startRow, startCol = divmod(move & 63, 8)
+            if self.board[startRow][startCol][1] != piece:
+                continue
+            flags = move >> 12
+            if flags & PROMOTION:
+                if PROMOTION_PIECES[flags & 3] != promotion.upper():
+                    continue
+            elif promotion != "":
+                continue
+            if any(
+                char != Move.colToAlpha[startCol] and char != Move.rowToRank[startRow]
+                for char in disambiguation
+            ):
+                continue
+            candidates.append(move)
+        if len(candidates) != 1:
+            raise ValueError("Illegal or ambiguous move " + san)
+        return candidates[0]
+
+    # Returns a legal move written in standard algebraic notation, see parseSan
+    def toSan(self, move):
+        startRow, startCol = divmod(move & 63, 8)
+        endRow, endCol = divmod((move >> 6) & 63, 8)
+        flags = move >> 12
+        piece = self.board[startRow][startCol][1]
+        target = Move.colToAlpha[endCol] + Move.rowToRank[endRow]
+        if flags == KING_CASTLE or flags == QUEEN_CASTLE:
+            san = "O-O" if flags == KING_CASTLE else "O-O-O"
+        elif piece == "p":
+            san = Move.colToAlpha[startCol] + "x" if flags & CAPTURE else ""
+            san += target
+            if flags & PROMOTION:
+                san += "=" + PROMOTION_PIECES[flags & 3]
+        else:
+            # other pieces of the same kind reaching the same square
+            others = [
+                other & 63
+                for other in self.getValidMoves()
+                if other != move
+                and (other >> 6) & 63 == (move >> 6) & 63
+                and self.board[(other & 63) // 8][(other & 63) % 8][1] == piece
+            ]
+            san = piece
+            if others:
+                if all(sq % 8 != startCol for sq in others):
+                    san += Move.colToAlpha[startCol]
+                elif all(sq // 8 != startRow for sq in others):
+                    san += Move.rowToRank[startRow]
+                else:
+                    san += Move.colToAlpha[startCol] + Move.rowToRank[startRow]
+            san += ("x" if flags & CAPTURE else "") + target
+
+        # the checkmate and stalemate flags belong to the current position
+        state = (self.inCheck, self.checkMate, self.staleMate)
+        self.makeMove(move)
+        if self.kingInCheck():
+            san += "#" if len(self.getValidMoves()) == 0 else "+"
+        self.undoMove()
+        self.inCheck, self.checkMate, self.staleMate = state
+        return san
+
+    # Plays a move of getValidMoves
+    def makeMove(self, move):
+        board = self.board
+        startRow, startCol = divmod(move & 63, 8)
+        endRow, endCol = divmod((move >> 6) & 63, 8)
+        flags = move >> 12
+        pieceMoved = board[startRow][startCol]
+        pieceCaptured = board[endRow][endCol]
 
         # Enpassant Move
-        if move.isEnpassantMove:
-            self.board[move.startRow][move.endCol] = "--"  # capturing the pawn
-
-        # enpassant update
-        if move.pieceMoved[1] == "p" and (
-            abs(move.startRow - move.endRow) == 2
-        ):  # only 2 squares pawn move
-            self.enpassant = ((move.startRow + move.endRow) // 2, move.endCol)
+        if flags == EN_PASSANT:
+            pieceCaptured = board[startRow][endCol]
+            board[startRow][endCol] = "--"  # capturing the pawn
+
+        # promotion
+        if flags & PROMOTION:
+            placedPiece = pieceMoved[0] + PROMOTION_PIECES[flags & 3]
         else:
-            self.enpassant = ()  # not en passant move
+            placedPiece = pieceMoved
+        board[startRow][startCol] = "--"
+        board[endRow][endCol] = placedPiece
+        # store history of move
+        entry = (
+            move | (PIECE_CODE[pieceMoved] << 16) | (PIECE_CODE[pieceCaptured] << 20)
+        )
+        oldEnpassant = self.enpassant
+        oldCastle = self.castle
+        self.undoLog.append((entry, oldCastle, oldEnpassant, self.hash, self.halfmove))
+        self.whiteTurn = not self.whiteTurn
 
-        self.enpassantLog.append(self.enpassant)
+        # update king's location
+        if pieceMoved == "wK":
+            self.whiteKingLocation = (endRow, endCol)
+        if pieceMoved == "bK":
+            self.blackKingLocation = (endRow, endCol)
+
+        # enpassant update, only 2 squares pawn move
+        if flags == DOUBLE_PUSH:
+            self.enpassant = ((startRow + endRow) // 2, endCol)
+        else:
+            self.enpassant = ()  # not en passant move
 
         # update castling right - whenever king move or rook move
-        self.updateCastleRight(move)
-        self.castleRightLog.append(
-            castleRight(
-                self.currentCastleRight.wK,
-                self.currentCastleRight.wQ,
-                self.currentCastleRight.bK,
-                self.currentCastleRight.bQ,
-            )
-        )
+        self.castle &= CASTLE_KEEP[move & 63] & CASTLE_KEEP[(move >> 6) & 63]
 
         # castle move
-        if move.isCastleMove:
-            if move.endCol - move.startCol == 2:
-                self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][
-                    move.endCol + 1
-                ]
-                self.board[move.endRow][move.endCol + 1] = "--"
-            else:
-                self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][
-                    move.endCol - 2
-                ]
-                self.board[move.endRow][move.endCol - 2] = "--"
+        if flags == KING_CASTLE:
+            board[endRow][endCol - 1] = board[endRow][endCol + 1]
+            board[endRow][endCol + 1] = "--"
+        elif flags == QUEEN_CASTLE:
+            board[endRow][endCol + 1] = board[endRow][endCol - 2]
+            board[endRow][endCol - 2] = "--"
+
+        self.hash = hash.hashMove(
+            move,
+            self.hash,
+            self.zobrist,
+            pieceMoved,
+            pieceCaptured,
+            placedPiece,
+            oldCastle,
+            self.castle,
+            oldEnpassant,
+            self.enpassant,
+        )
+        if pieceMoved[1] == "p" or pieceCaptured != "--":
+            self.halfmove = 0
+            self.repetitionLog.append({self.hash: 1})
+        else:
+            self.halfmove += 1
+            counts = self.repetitionLog[-1]
+            counts[self.hash] = counts.get(self.hash, 0) + 1
+        self.updateEvaluation(move, pieceMoved, pieceCaptured, placedPiece, 1)
 
     def undoMove(self):
-        if len(self.moveLog) != 0:
-            move = self.moveLog.pop()
-            self.hashLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+        if len(self.undoLog) != 0:
+            # positions are counted from the last reset of the clock
+            if self.halfmove == 0:
+                self.repetitionLog.pop()
+            else:
+                self.repetitionLog[-1][self.hash] -= 1
+            entry, self.castle, self.enpassant, self.hash, self.halfmove = (
+                self.undoLog.pop()
+            )
+            board = self.board
+            startRow, startCol = divmod(entry & 63, 8)
+            endRow, endCol = divmod((entry >> 6) & 63, 8)
+            flags = (entry >> 12) & 15
+            pieceMoved = PIECES[(entry >> 16) & 15]
+            pieceCaptured = PIECES[entry >> 20]
+            self.updateEvaluation(
+                entry, pieceMoved, pieceCaptured, board[endRow][endCol], -1
+            )
+            board[startRow][startCol] = pieceMoved
+            board[endRow][endCol] = pieceCaptured
             self.whiteTurn = not self.whiteTurn
 
             # update king's location
-            if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            if move.pieceMoved == "bK":
-                self.blackKingLocation = (move.startRow, move.startCol)
+            if pieceMoved == "wK":
+                self.whiteKingLocation = (startRow, startCol)
+            if pieceMoved == "bK":
+                self.blackKingLocation = (startRow, startCol)
 
             # undo enpassant move
-            if move.isEnpassantMove:
-                self.board[move.endRow][
-                    move.endCol
-                ] = "--"  # leave the landing square blank
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-
-            self.enpassantLog.pop()
-            self.enpassant = copy.deepcopy(self.enpassantLog[-1])
-
-            # undo castling right
-            self.castleRightLog.pop()
-            self.currentCastleRight = copy.deepcopy(self.castleRightLog[-1])
+            if flags == EN_PASSANT:
+                board[endRow][endCol] = "--"  # leave the landing square blank
+                board[startRow][endCol] = pieceCaptured
 
             # undo castle move
-            if move.isCastleMove:
-                if move.endCol - move.startCol == 2:
-                    self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][
-                        move.endCol - 1
-                    ]
-                    self.board[move.endRow][move.endCol - 1] = "--"
-                else:
-                    self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][
-                        move.endCol + 1
-                    ]
-                    self.board[move.endRow][move.endCol + 1] = "--"
+            if flags == KING_CASTLE:
+                board[endRow][endCol + 1] = board[endRow][endCol - 1]
+                board[endRow][endCol - 1] = "--"
+            elif flags == QUEEN_CASTLE:
+                board[endRow][endCol - 2] = board[endRow][endCol + 1]
+                board[endRow][endCol + 1] = "--"
 
             self.checkMate = False
             self.staleMate = False
 
-    def updateCastleRight(self, move):
-        if move.pieceMoved == "wK":
-            self.currentCastleRight.wK = False
-            self.currentCastleRight.wQ = False
-        elif move.pieceMoved == "bK":
-            self.currentCastleRight.bK = False
-            self.currentCastleRight.bQ = False
-        elif move.pieceMoved == "wR":
-            if move.startRow == 7:
-                if move.startCol == 0:
-                    self.currentCastleRight.wQ = False
-                elif move.startCol == 7:
-                    self.currentCastleRight.wK = False
-        elif move.pieceMoved == "bR":
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.currentCastleRight.bQ = False
-                elif move.startCol == 7:
-                    self.currentCastleRight.bK = False
-
-        if move.pieceCaptured == "wR":
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastleRight.wQ = False
-                elif move.endCol == 7:
-                    self.currentCastleRight.wK = False
-        elif move.pieceCaptured == "bR":
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastleRight.bQ = False
-                elif move.endCol == 7:
-                    self.currentCastleRight.bK = False
+    # Passes the turn without moving, used by the search for null move pruning.
+    # Must be taken back with undoNullMove before any other move is undone.
+    def makeNullMove(self):
+        self.undoLog.append(
+            (NULL_MOVE, self.castle, self.enpassant, self.hash, self.halfmove)
+        )
+        self.hash ^= hash.SIDE
+        if self.enpassant != ():
+            self.hash ^= hash.ENPASSANT[self.enpassant[1]]
+        # positions on both sides of a null move are not repetitions of each other,
+        # the clock starts over like after a pawn move
+        self.repetitionLog.append({self.hash: 1})
+        self.halfmove = 0
+        self.enpassant = ()
+        self.whiteTurn = not self.whiteTurn
+
+    def undoNullMove(self):
+        self.repetitionLog.pop()
+        self.enpassant, self.hash, self.halfmove = self.undoLog.pop()[2:]
+        self.whiteTurn = not self.whiteTurn
+
+    # Returns the move log entry of the last move (NULL_MOVE for a null move), or
+    # None at the start
+    def lastMove(self):
+        return self.undoLog[-1][0] if len(self.undoLog) != 0 else None
+
+    # Returns the played moves as Move objects, for display and notation
+    def getMoveLog(self):
+        return [Move.fromLog(record[0]) for record in self.undoLog]
+
+    # Returns True if the king of the side to move is attacked, without generating
+    # moves
+    def kingInCheck(self):
+        return self.checkForPinsAndChecks()[0]
 
     def getValidMoves(self):
         moves = []
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        self.attacked = self.getAttackMap()
         if self.whiteTurn:
             kingRow = self.whiteKingLocation[0]
             kingCol = self.whiteKingLocation[1]
@@ -223,20 +695,23 @@ class GameState:
                 check = self.checks[0]
                 checkRow = check[0]
                 checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]
-                validSqs = []
-                if pieceChecking[1] == "N":
-                    validSqs = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSq = (kingRow + check[2] * i, kingCol + check[3] * i)
-                        validSqs.append(validSq)
-                        if validSq[0] == checkRow and validSq[1] == checkCol:
-                            break
+                # capture the checking piece or block its line (knights have
+                # nothing between)
+                between = BETWEEN[kingRow * 8 + kingCol][checkRow * 8 + checkCol]
+                validSqs = between + ((checkRow, checkCol),)
                 for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].pieceMoved[1] != "K":
-                        if not (moves[i].endRow, moves[i].endCol) in validSqs:
-                            moves.remove(moves[i])
+                    move = moves[i]
+                    startRow, startCol = divmod(move & 63, 8)
+                    endRow, endCol = divmod((move >> 6) & 63, 8)
+                    if self.board[startRow][startCol][1] != "K":
+                        # en passant can remove a checking pawn from beside its end square
+                        if move >> 12 == EN_PASSANT and (startRow, endCol) == (
+                            checkRow,
+                            checkCol,
+                        ):
+                            continue
+                        if not (endRow, endCol) in validSqs:
+                            del moves[i]
             else:
                 self.KingMoves(kingRow, kingCol, moves)
         else:
@@ -263,6 +738,24 @@ class GameState:
                     self.piecesMove[piece](row, col, moves)
         return moves
 
+    # Appends the move from (row, col) to (endRow, endCol), flagged as a capture when
+    # the end square is taken
+    def addMove(self, row, col, endRow, endCol, moves):
+        flags = QUIET if self.board[endRow][endCol] == "--" else CAPTURE
+        moves.append(encodeMove(row, col, endRow, endCol, flags))
+
+    # Appends a pawn move, as one move per promotion piece (queen first) when it
+    # reaches the last row
+    def addPawnMove(self, row, col, endRow, endCol, moves):
+        flags = QUIET if self.board[endRow][endCol] == "--" else CAPTURE
+        if endRow == 0 or endRow == 7:
+            for piece in (3, 2, 1, 0):
+                moves.append(
+                    encodeMove(row, col, endRow, endCol, flags | PROMOTION | piece)
+                )
+        else:
+            moves.append(encodeMove(row, col, endRow, endCol, flags))
+
     def PawnMoves(self, row, col, moves):
         piecePinned = False
         pinDirection = ()
@@ -282,16 +775,18 @@ class GameState:
 
         if self.whiteTurn:
             if self.board[row - 1][col] == "--":
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((row, col), (row - 1, col), self.board))
+                if not piecePinned or pinDirection in ((-1, 0), (1, 0)):
+                    self.addPawnMove(row, col, row - 1, col, moves)
                     if row == 6:
                         if self.board[4][col] == "--":
-                            moves.append(Move((row, col), (4, col), self.board))
+                            moves.append(encodeMove(row, col, 4, col, DOUBLE_PUSH))
             if col - 1 >= 0:
                 if self.board[row - 1][col - 1][0] == "b":
                     if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((row, col), (row - 1, col - 1), self.board))
-                elif (row - 1, col - 1) == self.enpassant:
+                        self.addPawnMove(row, col, row - 1, col - 1, moves)
+                elif (row - 1, col - 1) == self.enpassant and (
+                    not piecePinned or pinDirection == (-1, -1)
+                ):
                     attackingPiece = blockingPiece = False
                     if kingRow == row:
                         if kingCol < col:
@@ -309,22 +804,20 @@ class GameState:
                                 square[1] == "R" or square[1] == "Q"
                             ):
                                 attackingPiece = True
+                                break
                             elif square != "--":
-                                blockingPiece = True
+                                break
                     if not attackingPiece or blockingPiece:
                         moves.append(
-                            Move(
-                                (row, col),
-                                (row - 1, col - 1),
-                                self.board,
-                                isEnpassantMove=True,
-                            )
+                            encodeMove(row, col, row - 1, col - 1, EN_PASSANT)
                         )
             if col + 1 <= 7:
                 if self.board[row - 1][col + 1][0] == "b":
                     if not piecePinned or pinDirection == (-1, 1):
-                        moves.append(Move((row, col), (row - 1, col + 1), self.board))
-                elif (row - 1, col + 1) == self.enpassant:
+                        self.addPawnMove(row, col, row - 1, col + 1, moves)
+                elif (row - 1, col + 1) == self.enpassant and (
+                    not piecePinned or pinDirection == (-1, 1)
+                ):
                     attackingPiece = blockingPiece = False
                     if kingRow == row:
                         if kingCol < col:
@@ -342,29 +835,27 @@ class GameState:
                                 square[1] == "R" or square[1] == "Q"
                             ):
                                 attackingPiece = True
+                                break
                             elif square != "--":
-                                blockingPiece = True
+                                break
                     if not attackingPiece or blockingPiece:
                         moves.append(
-                            Move(
-                                (row, col),
-                                (row - 1, col + 1),
-                                self.board,
-                                isEnpassantMove=True,
-                            )
+                            encodeMove(row, col, row - 1, col + 1, EN_PASSANT)
                         )
         else:
             if self.board[row + 1][col] == "--":
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((row, col), (row + 1, col), self.board))
+                if not piecePinned or pinDirection in ((1, 0), (-1, 0)):
+                    self.addPawnMove(row, col, row + 1, col, moves)
                     if row == 1:
                         if self.board[3][col] == "--":
-                            moves.append(Move((row, col), (3, col), self.board))
+                            moves.append(encodeMove(row, col, 3, col, DOUBLE_PUSH))
             if col - 1 >= 0:
                 if self.board[row + 1][col - 1][0] == "w":
                     if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((row, col), (row + 1, col - 1), self.board))
-                elif (row + 1, col - 1) == self.enpassant:
+                        self.addPawnMove(row, col, row + 1, col - 1, moves)
+                elif (row + 1, col - 1) == self.enpassant and (
+                    not piecePinned or pinDirection == (1, -1)
+                ):
                     attackingPiece = blockingPiece = False
                     if kingRow == row:
                         if kingCol < col:
@@ -382,23 +873,21 @@ class GameState:
                                 square[1] == "R" or square[1] == "Q"
                             ):
                                 attackingPiece = True
+                                break
                             elif square != "--":
-                                blockingPiece = True
+                                break
                     if not attackingPiece or blockingPiece:
                         moves.append(
-                            Move(
-                                (row, col),
-                                (row + 1, col - 1),
-                                self.board,
-                                isEnpassantMove=True,
-                            )
+                            encodeMove(row, col, row + 1, col - 1, EN_PASSANT)
                         )
 
             if col + 1 <= 7:
                 if self.board[row + 1][col + 1][0] == "w":
                     if not piecePinned or pinDirection == (1, 1):
-                        moves.append(Move((row, col), (row + 1, col + 1), self.board))
-                elif (row + 1, col + 1) == self.enpassant:
+                        self.addPawnMove(row, col, row + 1, col + 1, moves)
+                elif (row + 1, col + 1) == self.enpassant and (
+                    not piecePinned or pinDirection == (1, 1)
+                ):
                     attackingPiece = blockingPiece = False
                     if kingRow == row:
                         if kingCol < col:
@@ -416,16 +905,12 @@ class GameState:
                                 square[1] == "R" or square[1] == "Q"
                             ):
                                 attackingPiece = True
+                                break
                             elif square != "--":
-                                blockingPiece = True
+                                break
                     if not attackingPiece or blockingPiece:
                         moves.append(
-                            Move(
-                                (row, col),
-                                (row + 1, col + 1),
-                                self.board,
-                                isEnpassantMove=True,
-                            )
+                            encodeMove(row, col, row + 1, col + 1, EN_PASSANT)
                         )
 
     def RookMoves(self, row, col, moves):
@@ -439,26 +924,17 @@ class GameState:
                     self.pins.remove(self.pins[i])
                 break
 
-        straightDirections = ((-1, 0), (1, 0), (0, -1), (0, 1))
         enemyColor = "b" if self.whiteTurn else "w"
-        for d in straightDirections:
-            for i in range(1, 8):
-                endRow = row + d[0] * i
-                endCol = col + d[1] * i
-                if (0 <= endRow < 8) and (0 <= endCol < 8):
-                    if (
-                        not piecePinned
-                        or pinDirection == d
-                        or pinDirection == (-d[0], -d[1])
-                    ):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":
-                            moves.append(Move((row, col), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor:
-                            moves.append(Move((row, col), (endRow, endCol), self.board))
-                            break
-                        else:
-                            break
+        for d, ray in ROOK_RAYS[row * 8 + col]:
+            if piecePinned and pinDirection != d and pinDirection != (-d[0], -d[1]):
+                continue
+            for endRow, endCol in ray:
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--":
+                    moves.append(encodeMove(row, col, endRow, endCol))
+                elif endPiece[0] == enemyColor:
+                    moves.append(encodeMove(row, col, endRow, endCol, CAPTURE))
+                    break
                 else:
                     break
 
@@ -470,25 +946,12 @@ class GameState:
                 self.pins.remove(self.pins[i])
                 break
 
-        knightDirections = (
-            (-2, -1),
-            (-1, -2),
-            (1, -2),
-            (2, -1),
-            (2, 1),
-            (1, 2),
-            (-1, 2),
-            (-2, 1),
-        )
+        if piecePinned:
+            return
         allyColor = "w" if self.whiteTurn else "b"
-        for d in knightDirections:
-            endRow = row + d[0]
-            endCol = col + d[1]
-            if (0 <= endRow < 8) and (0 <= endCol < 8):
-                if not piecePinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != allyColor:
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
+        for endRow, endCol in KNIGHT_TARGETS[row * 8 + col]:
+            if self.board[endRow][endCol][0] != allyColor:
+                self.addMove(row, col, endRow, endCol, moves)
 
     def BishopMoves(self, row, col, moves):
         piecePinned = False
@@ -500,26 +963,17 @@ class GameState:
                 self.pins.remove(self.pins[i])
                 break
 
-        diagonalDirections = ((-1, -1), (1, 1), (1, -1), (-1, 1))
         enemyColor = "b" if self.whiteTurn else "w"
-        for d in diagonalDirections:
-            for i in range(1, 8):
-                endRow = row + d[0] * i
-                endCol = col + d[1] * i
-                if (0 <= endRow < 8) and (0 <= endCol < 8):
-                    if (
-                        not piecePinned
-                        or pinDirection == d
-                        or pinDirection == (-d[0], -d[1])
-                    ):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":
-                            moves.append(Move((row, col), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor:
-                            moves.append(Move((row, col), (endRow, endCol), self.board))
-                            break
-                        else:
-                            break
+        for d, ray in BISHOP_RAYS[row * 8 + col]:
+            if piecePinned and pinDirection != d and pinDirection != (-d[0], -d[1]):
+                continue
+            for endRow, endCol in ray:
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--":
+                    moves.append(encodeMove(row, col, endRow, endCol))
+                elif endPiece[0] == enemyColor:
+                    moves.append(encodeMove(row, col, endRow, endCol, CAPTURE))
+                    break
                 else:
                     break
 
@@ -529,37 +983,52 @@ class GameState:
             self.piecesMove[char](row, col, moves)
 
     def KingMoves(self, row, col, moves):
-        kingDirections = (
-            (-1, 0),
-            (1, 0),
-            (0, -1),
-            (0, 1),
-            (-1, -1),
-            (1, 1),
-            (1, -1),
-            (-1, 1),
-        )
         allyColor = "w" if self.whiteTurn else "b"
-        for i in range(8):
-            endRow = row + kingDirections[i][0]
-            endCol = col + kingDirections[i][1]
-            if (0 <= endRow < 8) and (0 <= endCol < 8):
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    # place king on the end of square to check
-                    if allyColor == "w":
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
-                    # place king back
-                    if allyColor == "w":
-                        self.whiteKingLocation = (row, col)
-                    else:
-                        self.blackKingLocation = (row, col)
-        self.getCastleMoves(row, col, moves, allyColor)
+        for endRow, endCol in KING_TARGETS[row * 8 + col]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] != allyColor and not self.attacked[endRow * 8 + endCol]:
+                self.addMove(row, col, endRow, endCol, moves)
+        self.getCastleMoves(row, col, moves)
+
+    # Returns the squares attacked by the side not to move as a bytearray indexed by
+    # row * 8 + col. Sliders see through the king of the side to move, which can't
+    # escape a check by stepping back along the checking line.
+    def getAttackMap(self):
+        attacked = bytearray(64)
+        board = self.board
+        enemyColor = "b" if self.whiteTurn else "w"
+        allyKing = "wK" if self.whiteTurn else "bK"
+        forward = 1 if enemyColor == "b" else -1
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != enemyColor:
+                    continue
+                pieceType = piece[1]
+                if pieceType == "p":
+                    # pawns never stand on the last row, so row + forward is on the
+                    # board
+                    if col > 0:
+                        attacked[(row + forward) * 8 + col - 1] = 1
+                    if col < 7:
+                        attacked[(row + forward) * 8 + col + 1] = 1
+                elif pieceType == "N" or pieceType == "K":
+                    targets = KNIGHT_TARGETS if pieceType == "N" else KING_TARGETS
+                    for endRow, endCol in targets[row * 8 + col]:
+                        attacked[endRow * 8 + endCol] = 1
+                else:
+                    rays = ()
+                    if pieceType != "B":
+                        rays = ROOK_RAYS[row * 8 + col]
+                    if pieceType != "R":
+                        rays += BISHOP_RAYS[row * 8 + col]
+                    for d, ray in rays:
+                        for endRow, endCol in ray:
+                            attacked[endRow * 8 + endCol] = 1
+                            endPiece = board[endRow][endCol]
+                            if endPiece != "--" and endPiece != allyKing:
+                                break
+        return attacked
 
     def checkForPinsAndChecks(self):
         pins = []
@@ -576,23 +1045,14 @@ class GameState:
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
 
-        directions = (
-            (-1, 0),
-            (1, 0),
-            (0, -1),
-            (0, 1),
-            (-1, -1),
-            (-1, 1),
-            (1, 1),
-            (1, -1),
-        )
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePins = ()
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
+        kingSq = startRow * 8 + startCol
+        # an enemy pawn one square away attacks the king from the diagonals ahead of
+        # it
+        pawnRow = -1 if enemyColor == "b" else 1
+        for rays, slider in ((ROOK_RAYS[kingSq], "R"), (BISHOP_RAYS[kingSq], "B")):
+            for d, ray in rays:
+                possiblePins = ()
+                for i, (endRow, endCol) in enumerate(ray):
                     endPiece = self.board[endRow][endCol]
                     if endPiece[0] == allyColor and endPiece[1] != "K":
                         if possiblePins == ():
@@ -602,290 +1062,211 @@ class GameState:
                     elif endPiece[0] == enemyColor:
                         pieceType = endPiece[1]
                         if (
-                            (0 <= j <= 3 and pieceType == "R")
-                            or (4 <= j <= 7 and pieceType == "B")
+                            pieceType == slider
+                            or pieceType == "Q"
+                            or (i == 0 and pieceType == "K")
                             or (
-                                i == 1
+                                i == 0
                                 and pieceType == "p"
-                                and (
-                                    (enemyColor == "b" and 4 <= j <= 5)
-                                    or (enemyColor == "w" and 6 <= j <= 7)
-                                )
+                                and slider == "B"
+                                and d[0] == pawnRow
                             )
-                            or (pieceType == "Q")
-                            or (i == 1 and pieceType == "K")
                         ):
                             if possiblePins == ():
                                 inCheck = True
                                 checks.append((endRow, endCol, d[0], d[1]))
-                                break
                             else:
                                 pins.append(possiblePins)
-                                break
-                        else:
-                            break
-                else:
-                    break
+                        break
 
-        knightDirections = (
-            (-2, -1),
-            (-1, -2),
-            (1, -2),
-            (2, -1),
-            (2, 1),
-            (1, 2),
-            (-1, 2),
-            (-2, 1),
-        )
-        for m in knightDirections:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if (endPiece[0] == enemyColor) and (endPiece[1] == "N"):
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
-                    break
+        for endRow, endCol in KNIGHT_TARGETS[kingSq]:
+            endPiece = self.board[endRow][endCol]
+            if (endPiece[0] == enemyColor) and (endPiece[1] == "N"):
+                inCheck = True
+                checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
+                break
 
         return inCheck, pins, checks
 
-    def getCastleMoves(self, row, col, moves, allyColor=""):
+    def getCastleMoves(self, row, col, moves):
         if self.inCheck:
             return  # can't castle while be checked
-        if (self.whiteTurn and self.currentCastleRight.wK) or (
-            not self.whiteTurn and self.currentCastleRight.bK
-        ):
-            self.getKingsideCastleMove(row, col, moves, allyColor)
-        if (self.whiteTurn and self.currentCastleRight.wQ) or (
-            not self.whiteTurn and self.currentCastleRight.bQ
-        ):
-            self.getQueensideCastleMove(row, col, moves, allyColor)
+        if self.castle & (WHITE_KINGSIDE if self.whiteTurn else BLACK_KINGSIDE):
+            self.getKingsideCastleMove(row, col, moves)
+        if self.castle & (WHITE_QUEENSIDE if self.whiteTurn else BLACK_QUEENSIDE):
+            self.getQueensideCastleMove(row, col, moves)
 
-    def getKingsideCastleMove(self, row, col, moves, allyColor=""):
+    # The king may not pass through or land on an attacked square
+    def getKingsideCastleMove(self, row, col, moves):
         if self.board[row][col + 1] == "--" and self.board[row][col + 2] == "--":
-            if allyColor == "w":
-                self.whiteKingLocation = (row, col + 1)
-            else:
-                self.blackKingLocation = (row, col + 1)
-            inCheck1, pins, checks = self.checkForPinsAndChecks()
-            if allyColor == "w":
-                self.whiteKingLocation = (row, col + 2)
-            else:
-                self.blackKingLocation = (row, col + 2)
-            inCheck2, pins, checks = self.checkForPinsAndChecks()
-            if allyColor == "w":
-                self.whiteKingLocation = (row, col)
-            else:
-                self.blackKingLocation = (row, col)
-
-            if not inCheck1 and not inCheck2:
-                moves.append(
-                    Move((row, col), (row, col + 2), self.board, isCastleMove=True)
-                )
+            square = row * 8 + col
+            if not self.attacked[square + 1] and not self.attacked[square + 2]:
+                moves.append(encodeMove(row, col, row, col + 2, KING_CASTLE))
 
-    def getQueensideCastleMove(self, row, col, moves, allyColor=""):
+    def getQueensideCastleMove(self, row, col, moves):
         if (
             self.board[row][col - 1] == "--"
             and self.board[row][col - 2] == "--"
             and self.board[row][col - 3] == "--"
         ):
-            if allyColor == "w":
-                self.whiteKingLocation = (row, col - 1)
+            # the rook passes over the b file square, the king does not
+            square = row * 8 + col
+            if not self.attacked[square - 1] and not self.attacked[square - 2]:
+                moves.append(encodeMove(row, col, row, col - 2, QUEEN_CASTLE))
+
+    # Computes the incrementally updated evaluation terms from the board
+    def initEvaluation(self):
+        self.pieceSquare = 0
+        self.earlyQueen = 0
+        # pawns per file and pawn squares, white then black
+        self.pawnFiles = [[0] * 8, [0] * 8]
+        self.pawnSquares = [set(), set()]
+        # zobrist hash of the pawns only, keys the pawn hash table
+        self.pawnKey = 0
+        self.queenCount = {"w": 0, "b": 0}
+        # knights, bishops, rooks and queens per colour
+        self.pieceCount = {"w": 0, "b": 0}
+        for row in range(8):
+            for col in range(8):
+                if self.board[row][col] != "--":
+                    self.addPiece(self.board[row][col], row, col, 1)
+
+    # Adds (sign 1) or removes (sign -1) a piece from the evaluation terms
+    def addPiece(self, piece, row, col, sign):
+        self.pieceSquare += sign * PIECE_SQUARE[piece][row][col]
+        if piece[1] == "p":
+            color = 0 if piece[0] == "w" else 1
+            self.pawnFiles[color][col] += sign
+            self.pawnKey ^= self.zobrist[row][col][hash.indexOf(piece)]
+            if sign > 0:
+                self.pawnSquares[color].add((row, col))
             else:
-                self.blackKingLocation = (row, col - 1)
-            inCheck1, pins, checks = self.checkForPinsAndChecks()
-            if allyColor == "w":
-                self.whiteKingLocation = (row, col - 2)
+                self.pawnSquares[color].discard((row, col))
+        elif piece[1] != "K":
+            self.pieceCount[piece[0]] += sign
+            if piece[1] == "Q":
+                self.earlyQueen += sign * EARLY_QUEEN[piece][row][col]
+                self.queenCount[piece[0]] += sign
+
+    # Applies (sign 1) or takes back (sign -1) a move in the evaluation terms given:
+    # placedPiece : piece standing on the end square after the move
+    def updateEvaluation(self, move, pieceMoved, pieceCaptured, placedPiece, sign):
+        startRow, startCol = divmod(move & 63, 8)
+        endRow, endCol = divmod((move >> 6) & 63, 8)
+        flags = (move >> 12) & 15
+        self.addPiece(pieceMoved, startRow, startCol, -sign)
+        if pieceCaptured != "--":
+            captureRow = startRow if flags == EN_PASSANT else endRow
+            self.addPiece(pieceCaptured, captureRow, endCol, -sign)
+        self.addPiece(placedPiece, endRow, endCol, sign)
+        if flags == KING_CASTLE or flags == QUEEN_CASTLE:
+            rook = pieceMoved[0] + "R"
+            if flags == KING_CASTLE:
+                rookStart, rookEnd = endCol + 1, endCol - 1
             else:
-                self.blackKingLocation = (row, col - 2)
-            inCheck2, pins, checks = self.checkForPinsAndChecks()
-            # if allyColor == 'w':
-            #     self.whiteKingLocation = (row, col - 3)
-            # else:
-            #     self.blackKingLocation = (row, col - 3)
-            # inCheck3, pins, checks = self.checkForPinsAndChecks()
-            if allyColor == "w":
-                self.whiteKingLocation = (row, col)
-            else:
-                self.blackKingLocation = (row, col)
-
-            if not inCheck1 and not inCheck2:
-                moves.append(
-                    Move((row, col), (row, col - 2), self.board, isCastleMove=True)
-                )
+                rookStart, rookEnd = endCol - 2, endCol + 1
+            self.addPiece(rook, endRow, rookStart, -sign)
+            self.addPiece(rook, endRow, rookEnd, sign)
 
     def evaluate(self):
-        # Check for repitition draws
-        if self.isRepitition():
+        # Check for repitition and fifty move draws
+        if self.isRepitition() or self.isFiftyMoveDraw():
             return 0
 
+        score = self.pieceSquare + self.pawnStructure()
+
+        # Prevent early queen moves
+        if self.startPly + len(self.undoLog) < 12:
+            score += self.earlyQueen
+
+        # Add king safety
+        if self.queenCount["b"] > 0:
+            score += self.kingSafety(True)
+        if self.queenCount["w"] > 0:
+            score -= self.kingSafety(False)
+        return score / 1000
+
+    # Returns pawn chain, doubled and passed pawn terms in thousandths of a pawn
+    def pawnStructure(self):
+        score = pawnTable.probe(self.pawnKey)
+        if score is None:
+            score = self.scorePawnStructure()
+            pawnTable.store(self.pawnKey, score)
+        return score
+
+    def scorePawnStructure(self):
         score = 0
-        b_pawns = [0, 0, 0, 0, 0, 0, 0, 0]
-        w_pawns = [0, 0, 0, 0, 0, 0, 0, 0]
-        development = 0
-        space = 0
-        b_safety = 0
-        w_safety = 0
-        b_queen_alive = False
-        w_queen_alive = False
-        for row, row_list in enumerate(self.board):
-            for col, piece in enumerate(row_list):
-                # piece evaluation
-                score += self.pieceValue[piece]
-
-                # count queens alive:
-                if piece == "wQ":
-                    w_queen_alive = True
-                if piece == "bQ":
-                    b_queen_alive = True
-
-                if piece == "wp":
-                    space += (7 - row) / 2
-                    if row == 1:
-                        space += 10
-                    w_pawns[col] += 1
-                    # centre
-                    if row in range(2, 6) and col in range(3, 5):
-                        score += 0.2
-                    # pawn structure
-                    if (
-                        self.board[max(0, row - 1)][max(0, col - 1)] == "wp"
-                        or self.board[max(0, row - 1)][min(7, col + 1)] == "wp"
-                    ):
-                        score += 0.02
-
-                elif piece == "bp":
-                    space -= row / 2
-                    if row == 6:
-                        space -= 10
-                    b_pawns[col] += 1
-                    # centre
-                    if row in range(2, 6) and col in range(3, 5):
-                        score -= 0.2
-                    # pawn structure
-                    if (
-                        self.board[min(7, row + 1)][max(0, col - 1)] == "bp"
-                        or self.board[min(7, row + 1)][min(7, col + 1)] == "bp"
-                    ):
-                        score -= 0.02
-                else:
-                    # Prevent early queen moves
-                    if (
-                        piece[1] == "Q"
-                        and len(self.moveLog) < 12
-                        and row in (2, 3, 4, 5)
-                    ):
-                        if piece[0] == "w":
-                            development -= 0.25
-                        elif piece[0] == "b":
-                            development += 0.25
-
-                    # development
-                    if piece[1] != "K" and piece[1] != "R":
-                        if piece[0] == "w" and row < 6:
-                            development += 0.15
-                        elif piece[0] == "b" and row > 1:
-                            development -= 0.15
-
-                    elif piece[1] == "R":
-                        if piece[0] == "w" and col in range(3, 7):
-                            development += 0.15
-                        elif piece[0] == "b" and col in range(3, 7):
-                            development -= 0.15
-                    elif piece[1] == "K":
-                        if piece[0] == "w" and col in (0, 1, 2, 6, 7):
-                            w_safety += 0.4
-
-                            # King safety
-                            castling_side_list = [(0, 1, 2), (5, 6, 7)]
-                            # king_pawns[a,b], where a is one square away from king, b is two squares away
-                            for castling_side in castling_side_list:
-                                if col in castling_side:
-                                    king_pawns = [0, 0]
-
-                                    for i in castling_side:
-                                        if self.board[6][i] == "wp":
-                                            king_pawns[0] += 1
-                                        if self.board[5][i] == "wp":
-                                            king_pawns[1] += 1
-
-                                    # evaluate safety
-                                    if king_pawns[0] < 2:
-                                        if king_pawns[0] == 0:
-                                            w_safety -= 0.5
-                                        elif king_pawns[1] == 2:
-                                            w_safety -= 0.05
-                                        elif king_pawns[1] == 1:
-                                            w_safety -= 0.1
-                                        elif king_pawns[1] == 0:
-                                            w_safety -= 0.3
-
-                        elif piece[0] == "b" and col in (0, 1, 2, 6, 7):
-                            b_safety += 0.4
-
-                            # King safety
-                            castling_side_list = [(0, 1, 2), (5, 6, 7)]
-                            # king_pawns[a,b], where a is one square away from king, b is two squares away
-                            for castling_side in castling_side_list:
-                                if col in castling_side:
-                                    king_pawns = [0, 0]
-
-                                    for i in castling_side:
-                                        if self.board[1][i] == "bp":
-                                            king_pawns[0] += 1
-                                        if self.board[2][i] == "bp":
-                                            king_pawns[1] += 1
-
-                                    # evaluate safety
-                                    if king_pawns[0] < 2:
-                                        if king_pawns[0] == 0:
-                                            b_safety -= 0.5
-                                        elif king_pawns[1] == 2:
-                                            b_safety -= 0.05
-                                        elif king_pawns[1] == 1:
-                                            b_safety -= 0.1
-                                        elif king_pawns[1] == 0:
-                                            b_safety -= 0.3
-
-                    # Knight on edge case
-                    if piece[1] == "N":
-                        if piece[0] == "w" and col in (0, 7):
-                            development -= 0.05
-                        elif piece[0] == "b" and col in (0, 7):
-                            development += 0.05
+        board = self.board
+        for row, col in self.pawnSquares[0]:
+            if (
+                board[max(0, row - 1)][max(0, col - 1)] == "wp"
+                or board[max(0, row - 1)][min(7, col + 1)] == "wp"
+            ):
+                score += 20
+        for row, col in self.pawnSquares[1]:
+            if (
+                board[min(7, row + 1)][max(0, col - 1)] == "bp"
+                or board[min(7, row + 1)][min(7, col + 1)] == "bp"
+            ):
+                score -= 20
 
+        w_pawns, b_pawns = self.pawnFiles
         # Check doubled pawns
         for stacked_pawns in w_pawns:
-            score -= max(0, stacked_pawns - 1) * 0.5
+            score -= max(0, stacked_pawns - 1) * 500
         for stacked_pawns in b_pawns:
-            score += max(0, stacked_pawns - 1) * 0.5
+            score += max(0, stacked_pawns - 1) * 500
 
         # Check passed pawns:
         for i in range(8):
             if (
                 w_pawns[i] > 0
                 and b_pawns[max(i - 1, 0)] == 0
-                and b_pawns[max(i, 0)] == 0
+                and b_pawns[i] == 0
                 and b_pawns[min(i + 1, 7)] == 0
             ):
-                score += 0.3
+                score += 300
             if (
                 b_pawns[i] > 0
                 and w_pawns[max(i - 1, 0)] == 0
-                and w_pawns[max(i, 0)] == 0
+                and w_pawns[i] == 0
                 and w_pawns[min(i + 1, 7)] == 0
             ):
-                score -= 0.3
+                score -= 300
+        return score
 
-        # Add developement and space
-        score += development + 0.05 * space
+    # Returns the safety of a king castled (or walked) to a wing in thousandths of a
+    # pawn, judged by the pawns in front of it
+    def kingSafety(self, white):
+        if white:
+            col = self.whiteKingLocation[1]
+            pawn, nearRow, farRow = "wp", 6, 5
+        else:
+            col = self.blackKingLocation[1]
+            pawn, nearRow, farRow = "bp", 1, 2
+        if col not in (0, 1, 2, 6, 7):
+            return 0
 
-        # Add king safety
-        if b_queen_alive:
-            score += w_safety
-        if w_queen_alive:
-            score -= b_safety
-        return score
+        safety = 400
+        # king_pawns[a,b], where a is one square away from king, b is two squares away
+        king_pawns = [0, 0]
+        for i in (0, 1, 2) if col <= 2 else (5, 6, 7):
+            if self.board[nearRow][i] == pawn:
+                king_pawns[0] += 1
+            if self.board[farRow][i] == pawn:
+                king_pawns[1] += 1
+
+        # evaluate safety
+        if king_pawns[0] < 2:
+            if king_pawns[0] == 0:
+                safety -= 500
+            elif king_pawns[1] == 2:
+                safety -= 50
+            elif king_pawns[1] == 1:
+                safety -= 100
+            elif king_pawns[1] == 0:
+                safety -= 300
+        return safety
 
     # returns number of pieces and pawns, (pieces valued higher)
     def piece_value_total(self):
@@ -895,24 +1276,20 @@ class GameState:
                 total += abs(self.pieceValue[piece])
         return total
 
-    def isRepitition(self):
-        latestState = self.hashLog[-1]
-        repitition = 1
-
-        for i in range(2, len(self.moveLog) + 1):
-            if (
-                self.moveLog[-i].pieceMoved == "wp"
-                or self.moveLog[-i].pieceMoved == "bp"
-            ):
-                return False
+    # Returns how often the current position occurred since the halfmove clock was
+    # last reset, itself included
+    def repetitionCount(self):
+        return self.repetitionLog[-1][self.hash]
 
-            if self.hashLog[-i] == latestState:
-                repitition += 1
-
-            if repitition == 3:
-                return True
+    def isRepitition(self):
+        return self.repetitionLog[-1][self.hash] >= 3
 
-        return False
+    # Returns True once fifty moves were played without a capture or pawn move,
+    # unless the last of them gave checkmate, which takes precedence
+    def isFiftyMoveDraw(self):
+        if self.halfmove < 100:
+            return False
+        return not self.kingInCheck() or len(self.getValidMoves()) != 0
 
 
 class Move:
@@ -952,6 +1329,43 @@ class Move:
             self.startCol * 1000 + self.startRow * 100 + self.endCol * 10 + self.endRow
         )
 
+    # Builds the Move of a packed move, board is the position before it is played
+    @classmethod
+    def fromInt(cls, move, board):
+        flags = move >> 12
+        return cls(
+            divmod(move & 63, 8),
+            divmod((move >> 6) & 63, 8),
+            board,
+            isEnpassantMove=flags == EN_PASSANT,
+            isCastleMove=flags == KING_CASTLE or flags == QUEEN_CASTLE,
+            promotedPiece=PROMOTION_PIECES[flags & 3] if flags & PROMOTION else "",
+        )
+
+    # Builds the Move of a move log entry of GameState
+    @classmethod
+    def fromLog(cls, entry):
+        board = [["--"] * 8 for row in range(8)]
+        startRow, startCol = divmod(entry & 63, 8)
+        endRow, endCol = divmod((entry >> 6) & 63, 8)
+        board[startRow][startCol] = PIECES[(entry >> 16) & 15]
+        board[endRow][endCol] = PIECES[entry >> 20]
+        return cls.fromInt(entry & MOVE_MASK, board)
+
+    # Returns the packed move, promotedPiece must be set on promotions
+    def toInt(self):
+        if self.isEnpassantMove:
+            flags = EN_PASSANT
+        elif self.isCastleMove:
+            flags = KING_CASTLE if self.endCol > self.startCol else QUEEN_CASTLE
+        elif self.pieceMoved[1] == "p" and abs(self.endRow - self.startRow) == 2:
+            flags = DOUBLE_PUSH
+        else:
+            flags = CAPTURE if self.isCapture else QUIET
+        if self.isPawnPromotion:
+            flags |= PROMOTION | PROMOTION_PIECES.index(self.promotedPiece)
+        return encodeMove(self.startRow, self.startCol, self.endRow, self.endCol, flags)
+
     # override function
     def __eq__(self, other):
         if isinstance(other, Move):
@@ -986,10 +1400,3 @@ class Move:
             moveString += "x"
         return moveString + endSquare
 
-
-class castleRight:
-    def __init__(self, wK, wQ, bK, bQ):
-        self.wK = wK
-        self.bK = bK
-        self.wQ = wQ
-        self.bQ = bQ
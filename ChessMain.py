@@ -10,6 +10,7 @@ warnings.filterwarnings("ignore", category=UserWarning, module="pygame")
 import math
 import pygame as p
 import ChessEngine
+import BitboardEngine
 import ChessAI as ai
 
 # CONSTANT
@@ -21,6 +22,14 @@ DIMENSION = 8
 # 512/8 = 64, each square is 64 pixels
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 240
+# milliseconds the AI may think per move
+AI_MOVE_TIME = 5000
+# GameState backend, ChessEngine.GameState walks the board list instead of bitboards
+GAME_STATE = BitboardEngine.GameState
+# Opening book used by the AI when the file exists, see OpeningBook.py
+BOOK_PATH = "book.bin"
+# Endgame tables used by the AI when the folder exists, see Tablebase.py
+TABLEBASE_PATH = "tablebases"
 IMAGES = {}
 
 
@@ -38,14 +47,20 @@ def main():
     screen = p.display.set_mode((WIDTH + MOVE_LOG_PANEL_WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
-    validMoves = gs.getValidMoves()
+    gs = GAME_STATE()
+    validMoves = getValidMoves(gs)
+    # played moves as Move objects, for the move log panel
+    moveLog = []
     moveMade = False
     animate = False
     gameOver = False
     playerOne = True
     playerTwo = False
     load_images()
+    if os.path.exists(BOOK_PATH):
+        ai.setOpeningBook(BOOK_PATH)
+    if os.path.isdir(TABLEBASE_PATH):
+        ai.setTablebase(TABLEBASE_PATH)
     # store user input
     # (tuple: (row, col))
     sqSelected = ()
@@ -85,7 +100,9 @@ def main():
                         #     # make move if valid
                         if move in validMoves:
                             move = validMoves[validMoves.index(move)]
-                            gs.makeMove(move, humanTurn)
+                            if move.isPawnPromotion:
+                                move.promotedPiece = askPromotion()
+                            gs.makeMove(move.toInt())
                             moveMade = True
                             animate = True
                             sqSelected = ()
@@ -102,8 +119,9 @@ def main():
                     playerOne = True
                     playerTwo = True
                 elif e.key == p.K_r:  # reset game when pressed r
-                    gs = ChessEngine.GameState()
-                    validMoves = gs.getValidMoves()
+                    gs = GAME_STATE()
+                    validMoves = getValidMoves(gs)
+                    moveLog = []
                     moveMade = False
                     animate = False
                     gameOver = False
@@ -129,25 +147,25 @@ def main():
             if not gs.whiteTurn:
                 white = -1
 
-            value = gs.piece_value_total()
-            depth = 4 + (78 - value) // 59
-            # depth = 5
-            # Use parallel minimax for better performance
-            move = ai.minimax_parallel(gs, depth, white)
+            # Search as deep as the time budget allows, using all cores
+            move = ai.iterativeDeepening(
+                gs, white, moveTime=AI_MOVE_TIME, parallel=True
+            )
             if not (move == None):
                 moveMade = True
                 animate = True
-                gs.makeMove(move, False)
+                gs.makeMove(move)
 
         if moveMade:
-            print(gs.hashLog)
+            print(gs.hash)
+            moveLog = gs.getMoveLog()
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
+                animateMove(moveLog[-1], screen, gs.board, clock)
+            validMoves = getValidMoves(gs)
             moveMade = False
             animate = False
 
-        drawGameState(screen, gs, validMoves, sqSelected)
+        drawGameState(screen, gs, validMoves, sqSelected, moveLog)
 
         if gs.checkMate or gs.staleMate:
             gameOver = True
@@ -159,11 +177,28 @@ def main():
                     drawEndGameText(screen, "BLACK WIN")
                 else:
                     drawEndGameText(screen, "WHITE WIN")
+        elif gs.isFiftyMoveDraw():
+            gameOver = True
+            drawEndGameText(screen, "DRAW")
 
         clock.tick(MAX_FPS)
         p.display.flip()
 
 
+# Returns the legal moves as Move objects, promotions once per promotion piece
+def getValidMoves(gs):
+    return [ChessEngine.Move.fromInt(move, gs.board) for move in gs.getValidMoves()]
+
+
+# Asks the player for the piece to promote to
+def askPromotion():
+    promotedPiece = ""
+    while promotedPiece not in ("Q", "R", "B", "N"):
+        promotedPiece = input("Enter the piece you want to promote to (Q, R, B, N): ")
+        promotedPiece = promotedPiece.upper()
+    return promotedPiece
+
+
 def highlightMove(screen, gs, validMoves, sqSelected):
     sq = p.Surface((SQ_SIZE, SQ_SIZE))
     sq.set_alpha(100)
@@ -195,14 +230,13 @@ def highlightMove(screen, gs, validMoves, sqSelected):
                 (gs.blackKingLocation[1] * SQ_SIZE, gs.blackKingLocation[0] * SQ_SIZE),
             )
 
-    if len(gs.moveLog) != 0:
+    lastMove = gs.lastMove()
+    if lastMove is not None:
         sq.fill(p.Color("yellow"))
-        screen.blit(
-            sq, (gs.moveLog[-1].startCol * SQ_SIZE, gs.moveLog[-1].startRow * SQ_SIZE)
-        )
-        screen.blit(
-            sq, (gs.moveLog[-1].endCol * SQ_SIZE, gs.moveLog[-1].endRow * SQ_SIZE)
-        )
+        startRow, startCol = divmod(lastMove & 63, 8)
+        endRow, endCol = divmod((lastMove >> 6) & 63, 8)
+        screen.blit(sq, (startCol * SQ_SIZE, startRow * SQ_SIZE))
+        screen.blit(sq, (endCol * SQ_SIZE, endRow * SQ_SIZE))
 
 
 def animateMove(move, screen, board, clock):
@@ -248,12 +282,12 @@ def animateMove(move, screen, board, clock):
         clock.tick(144)
 
 
-def drawGameState(screen, gs, validMoves, sqSelected):
+def drawGameState(screen, gs, validMoves, sqSelected, moveLog):
     drawBoard(screen)
     highlightMove(screen, gs, validMoves, sqSelected)
     drawPieces(screen, gs.board)
     drawEval(screen, gs)
-    drawMoveLog(screen, gs)
+    drawMoveLog(screen, moveLog)
 
 
 def drawBoard(screen):
@@ -299,10 +333,9 @@ def drawEval(screen, gs):
     screen.blit(textObject, textLocation)
 
 
-def drawMoveLog(screen, gs):
+def drawMoveLog(screen, moveLog):
     moveLogRect = p.Rect(WIDTH, 20, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
     p.draw.rect(screen, p.Color("black"), moveLogRect)
-    moveLog = gs.moveLog
     moveTexts = []
     for i in range(0, len(moveLog), 2):
         moveString = str(i // 2 + 1) + ". " + str(moveLog[i]) + " "
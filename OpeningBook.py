@@ -0,0 +1,206 @@
+# Opening book: known opening moves looked up by the zobrist hash of the position,
+# so the first moves of a game don't need a search.
+#
+# The book file is an 8 byte header followed by entries of (key, move, weight)
+# sorted by key, read through mmap with a binary search. The file is only ever
+# opened read only, so every process using it shares the same pages.
+#
+# python3 OpeningBook.py build book.bin games.pgn [more.pgn ...] --plies 16
+# python3 OpeningBook.py probe book.bin --fen "<fen>"
+import argparse
+import mmap
+import random
+import re
+import struct
+import sys
+import ChessEngine
+
+MAGIC = b"CHSBOOK1"
+# zobrist key, move, weight
+ENTRY = struct.Struct("<QHH")
+KEY = struct.Struct("<Q")
+MAX_WEIGHT = 0xFFFF
+
+DEFAULT_PLIES = 16
+
+# Everything in PGN movetext that is not a move: comments, variations, NAGs, move
+# numbers and results. Brace comments can span lines and are removed from the
+# joined movetext, rest of line comments by stripLineComment.
+COMMENT = re.compile(r"\{[^}]*\}")
+NAG = re.compile(r"\$\d+")
+MOVE_NUMBER = re.compile(r"\d+\.+")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+class OpeningBook:
+    # path : book file written by buildBook
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("Not an opening book: " + path)
+        self.size = (len(self.map) - len(MAGIC)) // ENTRY.size
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    # Returns the index of the first entry with a key not below key
+    def lowerBound(self, key):
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.map, len(MAGIC) + middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Returns the (move, weight) pairs stored for key
+    def probe(self, key):
+        entries = []
+        index = self.lowerBound(key)
+        while index < self.size:
+            entryKey, move, weight = ENTRY.unpack_from(
+                self.map, len(MAGIC) + index * ENTRY.size
+            )
+            if entryKey != key:
+                break
+            entries.append((move, weight))
+            index += 1
+        return entries
+
+    # Returns a book move for the position of gs chosen at random in proportion to
+    # the weights, or None when the position is not in the book
+    def chooseMove(self, gs, generator=random):
+        entries = self.probe(gs.hash)
+        if len(entries) == 0:
+            return None
+        # guard against key collisions with positions outside the book
+        validMoves = gs.getValidMoves()
+        entries = [(move, weight) for move, weight in entries if move in validMoves]
+        if len(entries) == 0:
+            return None
+        moves = [move for move, weight in entries]
+        weights = [max(weight, 1) for move, weight in entries]
+        return generator.choices(moves, weights)[0]
+
+
+# Returns (line without its ; rest of line comment, True if the line ends inside a
+# brace comment) given whether it starts inside one, where a ; is part of the comment
+def stripLineComment(line, inBrace):
+    for i, char in enumerate(line):
+        if inBrace:
+            inBrace = char != "}"
+        elif char == "{":
+            inBrace = True
+        elif char == ";":
+            return line[:i], False
+    return line, inBrace
+
+
+# Yields the SAN moves of every game of a PGN file, one list per game
+def readPgnGames(file):
+    movetext = []
+    inBrace = False
+    for line in file:
+        line = line.strip()
+        if line.startswith("["):
+            # tags start the next game
+            if movetext:
+                yield parseMovetext(" ".join(movetext))
+                movetext = []
+            inBrace = False
+        elif line != "" and not line.startswith("%"):
+            line, inBrace = stripLineComment(line, inBrace)
+            movetext.append(line)
+    if movetext:
+        yield parseMovetext(" ".join(movetext))
+
+
+# Returns the SAN moves of the main line of a game's movetext
+def parseMovetext(text):
+    text = COMMENT.sub(" ", text)
+    # drop variations, which can be nested
+    mainLine = []
+    depth = 0
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(0, depth - 1)
+        elif depth == 0:
+            mainLine.append(char)
+    text = NAG.sub(" ", "".join(mainLine))
+    text = MOVE_NUMBER.sub(" ", text)
+    return [token for token in text.split() if token not in RESULTS]
+
+
+# Builds a book from PGN files given:
+# pgnPaths : PGN files to read
+# outPath : book file to write
+# plies : number of half moves of every game stored
+# minCount : moves played fewer times than this are left out
+# Each move is weighted by the number of games it was played in. Returns the
+# number of entries written.
+def buildBook(pgnPaths, outPath, plies=DEFAULT_PLIES, minCount=1):
+    counts = {}
+    gs = ChessEngine.GameState()
+    start = gs.getPosition()
+    for path in pgnPaths:
+        with open(path, encoding="utf-8", errors="replace") as file:
+            for sanMoves in readPgnGames(file):
+                gs.setPosition(start)
+                for san in sanMoves[:plies]:
+                    try:
+                        move = gs.parseSan(san)
+                    except ValueError:
+                        # rest of a broken game is skipped
+                        break
+                    entry = (gs.hash, move)
+                    counts[entry] = counts.get(entry, 0) + 1
+                    gs.makeMove(move)
+
+    entries = sorted(
+        (key, move, min(count, MAX_WEIGHT))
+        for (key, move), count in counts.items()
+        if count >= minCount
+    )
+    with open(outPath, "wb") as file:
+        file.write(MAGIC)
+        for entry in entries:
+            file.write(ENTRY.pack(*entry))
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Opening book builder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("book")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("--plies", type=int, default=DEFAULT_PLIES)
+    build.add_argument("--min-count", type=int, default=1)
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", help="position to look up, the start by default")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = buildBook(args.pgn, args.book, args.plies, args.min_count)
+        print("wrote " + str(count) + " entries to " + args.book)
+        return 0
+
+    gs = ChessEngine.GameState()
+    if args.fen is not None:
+        gs.setFen(args.fen)
+    book = OpeningBook(args.book)
+    for move, weight in book.probe(gs.hash):
+        print(ChessEngine.moveNotation(move) + " " + str(weight))
+    book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
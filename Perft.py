@@ -0,0 +1,126 @@
+# Perft: counts the leaf nodes of the move generation tree to a fixed depth, to
+# check the move generator against known node counts and to measure its speed.
+#
+# python3 Perft.py                      check every standard position
+# python3 Perft.py --backend mailbox    check the list based generator
+# python3 Perft.py --fen "<fen>" --depth 3 --divide
+import argparse
+import sys
+import time
+import ChessEngine
+import BitboardEngine
+
+BACKENDS = {
+    "bitboard": BitboardEngine.GameState,
+    "mailbox": ChessEngine.GameState,
+}
+
+# (name, fen, known node counts from depth 1)
+POSITIONS = [
+    (
+        "start",
+        "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609],
+    ),
+    (
+        "kiwipete",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603],
+    ),
+    (
+        "enpassant",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624],
+    ),
+    (
+        "promotion",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333],
+    ),
+    (
+        "promotion-mirrored",
+        "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+        [6, 264, 9467, 422333],
+    ),
+    (
+        "discovered-check",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487],
+    ),
+]
+
+
+# Returns the number of leaf nodes depth plies below the current position
+def perft(gs, depth):
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+# Returns the perft count below each root move as a list of (notation, nodes)
+def divide(gs, depth):
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        nodes = perft(gs, depth - 1) if depth > 1 else 1
+        gs.undoMove()
+        results.append((ChessEngine.moveNotation(move), nodes))
+    return results
+
+
+# Runs perft on fen and prints nodes and nodes/sec, returns the node count
+def run(stateClass, fen, depth, name="", showDivide=False):
+    gs = stateClass()
+    gs.setFen(fen)
+    start = time.time()
+    if showDivide:
+        results = divide(gs, depth)
+        for notation, count in results:
+            print(notation + ": " + str(count))
+        nodes = sum(count for notation, count in results)
+    else:
+        nodes = perft(gs, depth)
+    elapsed = max(time.time() - start, 1e-9)
+    print(
+        "%-20s depth %d  nodes %10d  time %7.2fs  nps %8d"
+        % (name, depth, nodes, elapsed, nodes / elapsed)
+    )
+    return nodes
+
+
+# Checks every standard position up to maxDepth, returns True if all counts match
+def runSuite(stateClass, maxDepth):
+    passed = True
+    for name, fen, expected in POSITIONS:
+        for depth in range(1, min(maxDepth, len(expected)) + 1):
+            nodes = run(stateClass, fen, depth, name)
+            if nodes != expected[depth - 1]:
+                print("  FAILED: expected " + str(expected[depth - 1]))
+                passed = False
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move generator perft")
+    parser.add_argument("--backend", choices=BACKENDS.keys(), default="bitboard")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fen", help="run a single position instead of the suite")
+    parser.add_argument("--divide", action="store_true", help="count per root move")
+    args = parser.parse_args()
+
+    stateClass = BACKENDS[args.backend]
+    if args.fen is not None:
+        run(stateClass, args.fen, args.depth, showDivide=args.divide)
+        return 0
+    return 0 if runSuite(stateClass, args.depth) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,587 @@
+# Endgame tablebases: exact results of every position with few pieces, generated by
+# retrograde analysis so the search can play small endings perfectly.
+#
+# A table covers one material, named by the white pieces followed by the black
+# pieces (KQK, KRK, KPK, KBNK, KQKR ...), and stores one byte per position:
+#   0          draw
+#   1..127     the side to move mates in that many plies
+#   128 + n    the side to move is mated in n plies (128 : checkmated now)
+#   255        not a legal position
+# Positions are indexed by the squares of the pieces in the order of the name and
+# the side to move, castling and en passant are never possible in a table.
+# Captures and promotions leave the table, their results are read from the smaller
+# tables, which are generated first when missing.
+#
+# python3 Tablebase.py generate KQK KRK KPK --directory tablebases
+# python3 Tablebase.py probe --fen "<fen>"
+#
+# Generation is plain Python, a 3 piece table takes seconds but a 4 piece table has
+# 33 million positions and takes the better part of an hour.
+import argparse
+import mmap
+import os
+import sys
+import time
+from itertools import product
+import ChessEngine
+from BitboardEngine import (
+    BISHOP_RAYS,
+    KING_ATTACKS,
+    KNIGHT_ATTACKS,
+    PAWN_ATTACKS,
+    ROOK_RAYS,
+    slidingAttacks,
+)
+
+DEFAULT_DIRECTORY = "tablebases"
+EXTENSION = ".tb"
+MAX_PIECES = 4
+
+DRAW = 0
+LOSS = 128
+INVALID = 255
+# only used while generating
+UNKNOWN = 254
+
+# Order of the pieces of a side in a table name, and their values for picking
+# which side of a material is white
+NAME_ORDER = "KQRBNP"
+NAME_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+PROMOTIONS = "QRBN"
+# Materials where nobody can ever be mated
+DRAWN = ("KK", "KBK", "KNK")
+
+ROOK_EMPTY = [slidingAttacks(sq, 0, ROOK_RAYS) for sq in range(64)]
+BISHOP_EMPTY = [slidingAttacks(sq, 0, BISHOP_RAYS) for sq in range(64)]
+
+
+# Returns the bitboard of the squares strictly between a and b on an empty board
+def betweenSquares(a, b):
+    rowA, colA = divmod(a, 8)
+    rowB, colB = divmod(b, 8)
+    dRow = (rowB > rowA) - (rowB < rowA)
+    dCol = (colB > colA) - (colB < colA)
+    aligned = rowA == rowB or colA == colB or abs(rowB - rowA) == abs(colB - colA)
+    if a == b or not aligned:
+        return 0
+    between = 0
+    sq = a + dRow * 8 + dCol
+    while sq != b:
+        between |= 1 << sq
+        sq += dRow * 8 + dCol
+    return between
+
+
+BETWEEN = [[betweenSquares(a, b) for b in range(64)] for a in range(64)]
+
+
+# Returns the board pieces ("wK", "wQ", "bK" ...) of a table name in index order
+def layoutOf(name):
+    split = name.index("K", 1)
+    white = ["w" + kind.replace("P", "p") for kind in name[:split]]
+    black = ["b" + kind.replace("P", "p") for kind in name[split:]]
+    return white + black
+
+
+# Returns the table name of a list of board pieces and whether its colours have to
+# be swapped to match the table, which always has the stronger side as white
+def materialName(pieces):
+    sides = {"w": [], "b": []}
+    for piece in pieces:
+        sides[piece[0]].append(piece[1].upper())
+    white = "".join(sorted(sides["w"], key=NAME_ORDER.index))
+    black = "".join(sorted(sides["b"], key=NAME_ORDER.index))
+    whiteValue = sum(NAME_VALUES[kind] for kind in white)
+    blackValue = sum(NAME_VALUES[kind] for kind in black)
+    if (whiteValue, white) >= (blackValue, black):
+        return white + black, False
+    return black + white, True
+
+
+# Returns the index of a position given the squares in layout order
+def indexOf(squares, whiteTurn):
+    index = 0 if whiteTurn else 1
+    for sq in squares:
+        index = index * 64 + sq
+    return index
+
+
+# Returns (squares, whiteTurn) of the position at index in a table of n pieces
+def positionOf(index, n):
+    squares = [0] * n
+    for i in range(n - 1, -1, -1):
+        index, squares[i] = divmod(index, 64)
+    return squares, index == 0
+
+
+# Returns True if a piece of color ("w" or "b") attacks target, captured pieces
+# having the square -1
+def attacked(layout, squares, target, color, occupied):
+    bit = 1 << target
+    for piece, sq in zip(layout, squares):
+        if piece[0] != color or sq < 0:
+            continue
+        kind = piece[1]
+        if kind == "K":
+            if KING_ATTACKS[sq] & bit:
+                return True
+        elif kind == "N":
+            if KNIGHT_ATTACKS[sq] & bit:
+                return True
+        elif kind == "p":
+            if PAWN_ATTACKS[0 if color == "w" else 1][sq] & bit:
+                return True
+        elif (kind != "B" and ROOK_EMPTY[sq] & bit) or (
+            kind != "R" and BISHOP_EMPTY[sq] & bit
+        ):
+            if not BETWEEN[sq][target] & occupied:
+                return True
+    return False
+
+
+# Returns True if the position is legal: no two pieces on a square, no pawn on the
+# first or last rank and the side that just moved not in check
+def isLegal(layout, squares, whiteTurn):
+    occupied = 0
+    for piece, sq in zip(layout, squares):
+        if occupied >> sq & 1:
+            return False
+        if piece[1] == "p" and (sq < 8 or sq >= 56):
+            return False
+        occupied |= 1 << sq
+    moved = "b" if whiteTurn else "w"
+    king = squares[layout.index(moved + "K")]
+    return not attacked(layout, squares, king, "w" if whiteTurn else "b", occupied)
+
+
+# Returns the legal moves of the side to move as (piece index, end square, captured
+# piece index or -1, promotion piece or None)
+def legalMoves(layout, squares, whiteTurn):
+    color = "w" if whiteTurn else "b"
+    enemy = "b" if whiteTurn else "w"
+    occupied = 0
+    own = 0
+    for piece, sq in zip(layout, squares):
+        occupied |= 1 << sq
+        if piece[0] == color:
+            own |= 1 << sq
+    king = layout.index(color + "K")
+
+    moves = []
+    for i, piece in enumerate(layout):
+        if piece[0] != color:
+            continue
+        start = squares[i]
+        kind = piece[1]
+        if kind == "K":
+            targets = KING_ATTACKS[start] & ~own
+        elif kind == "N":
+            targets = KNIGHT_ATTACKS[start] & ~own
+        elif kind == "p":
+            step = -8 if whiteTurn else 8
+            targets = PAWN_ATTACKS[0 if whiteTurn else 1][start] & occupied & ~own
+            if not occupied >> (start + step) & 1:
+                targets |= 1 << (start + step)
+                homeRow = 6 if whiteTurn else 1
+                if start // 8 == homeRow and not occupied >> (start + 2 * step) & 1:
+                    targets |= 1 << (start + 2 * step)
+        else:
+            targets = 0
+            if kind != "B":
+                targets |= slidingAttacks(start, occupied, ROOK_RAYS)
+            if kind != "R":
+                targets |= slidingAttacks(start, occupied, BISHOP_RAYS)
+            targets &= ~own
+
+        while targets:
+            end = (targets & -targets).bit_length() - 1
+            targets &= targets - 1
+            captured = -1
+            if occupied >> end & 1:
+                captured = next(j for j, sq in enumerate(squares) if sq == end)
+            after = list(squares)
+            after[i] = end
+            if captured >= 0:
+                after[captured] = -1
+            afterOccupied = (occupied & ~(1 << start)) | (1 << end)
+            if attacked(layout, after, after[king], enemy, afterOccupied):
+                continue
+            if kind == "p" and (end < 8 or end >= 56):
+                for promotion in PROMOTIONS:
+                    moves.append((i, end, captured, promotion))
+            else:
+                moves.append((i, end, captured, None))
+    return moves
+
+
+# Returns the squares the piece at index i of the side that just moved could have
+# come from without capturing or promoting
+def retractions(layout, squares, i, occupied):
+    piece = layout[i]
+    sq = squares[i]
+    kind = piece[1]
+    if kind == "K":
+        origins = KING_ATTACKS[sq] & ~occupied
+    elif kind == "N":
+        origins = KNIGHT_ATTACKS[sq] & ~occupied
+    elif kind == "p":
+        origins = 0
+        step = 8 if piece[0] == "w" else -8
+        origin = sq + step
+        # the pawn came from a square it can stand on
+        if 8 <= origin < 56 and not occupied >> origin & 1:
+            origins |= 1 << origin
+            doubleRow = 4 if piece[0] == "w" else 3
+            if sq // 8 == doubleRow and not occupied >> (origin + step) & 1:
+                origins |= 1 << (origin + step)
+    else:
+        origins = 0
+        if kind != "B":
+            origins |= slidingAttacks(sq, occupied, ROOK_RAYS)
+        if kind != "R":
+            origins |= slidingAttacks(sq, occupied, BISHOP_RAYS)
+        origins &= ~occupied
+    return origins
+
+
+class Tablebase:
+    # directory : folder holding the .tb files
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        # name : (file, mmap), or None when there is no table
+        self.tables = {}
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+                table[0].close()
+        self.tables = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name + EXTENSION)
+
+    # Returns the mmap of the table name, or None if it has not been generated
+    def table(self, name):
+        if name not in self.tables:
+            path = self.path(name)
+            if os.path.exists(path):
+                file = open(path, "rb")
+                self.tables[name] = (
+                    file,
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ),
+                )
+            else:
+                self.tables[name] = None
+        table = self.tables[name]
+        return None if table is None else table[1]
+
+    # Returns the stored value for pieces, a list of (board piece, square), with
+    # whiteTurn to move, or None if the table is missing
+    def lookup(self, pieces, whiteTurn):
+        name, flip = materialName(piece for piece, sq in pieces)
+        if name in DRAWN:
+            return DRAW
+        table = self.table(name)
+        if table is None:
+            return None
+        if flip:
+            # mirror the ranks and swap the colours
+            pieces = [(swapColor(piece), sq ^ 56) for piece, sq in pieces]
+            whiteTurn = not whiteTurn
+        remaining = sorted(pieces)
+        squares = []
+        for piece in layoutOf(name):
+            # identical pieces are interchangeable
+            j = next(j for j, placed in enumerate(remaining) if placed[0] == piece)
+            squares.append(remaining.pop(j)[1])
+        return table[indexOf(squares, whiteTurn)]
+
+    # Returns the value of the position of gs for the side to move, or None when it
+    # is not covered by a table
+    def probe(self, gs):
+        count = 2 + gs.pieceCount["w"] + gs.pieceCount["b"]
+        count += len(gs.pawnSquares[0]) + len(gs.pawnSquares[1])
+        if count > MAX_PIECES or canCaptureEnpassant(gs):
+            return None
+        if gs.castle != 0:
+            return None
+        pieces = []
+        for row in range(8):
+            for col in range(8):
+                if gs.board[row][col] != "--":
+                    pieces.append((gs.board[row][col], row * 8 + col))
+        return self.lookup(pieces, gs.whiteTurn)
+
+    # Returns (move, value) of the best move of gs, value being the table value of
+    # the position for the side to move, or None when it is not covered by a table.
+    # Wins are played as fast as possible and losses dragged out as long as possible.
+    def bestMove(self, gs):
+        value = self.probe(gs)
+        if value is None or value == INVALID:
+            return None
+        best = None
+        bestRank = None
+        for move in gs.getValidMoves():
+            gs.makeMove(move)
+            child = self.probe(gs)
+            gs.undoMove()
+            if child is None or child == INVALID:
+                return None
+            rank = rankOf(child)
+            if bestRank is None or rank > bestRank:
+                best, bestRank = move, rank
+        return None if best is None else (best, value)
+
+
+# Returns True if the side to move has an en passant capture, which the tables
+# don't know about
+def canCaptureEnpassant(gs):
+    if gs.enpassant == ():
+        return False
+    row, col = gs.enpassant
+    pawnRow, pawn = (row + 1, "wp") if gs.whiteTurn else (row - 1, "bp")
+    return any(
+        0 <= pawnCol < 8 and gs.board[pawnRow][pawnCol] == pawn
+        for pawnCol in (col - 1, col + 1)
+    )
+
+
+# Returns the colour swapped board piece
+def swapColor(piece):
+    return ("b" if piece[0] == "w" else "w") + piece[1]
+
+
+# Orders the value of a child position from the point of view of the parent: wins
+# (the child is lost) first and shortest, then draws, then losses longest first
+def rankOf(child):
+    if child >= LOSS:
+        return 1000 - (child - LOSS)
+    if child == DRAW:
+        return 0
+    return -1000 + child
+
+
+# Returns the value for the side to move of a position whose best child has value
+# child, for the side to move there
+def parentValue(child):
+    if child == DRAW:
+        return DRAW
+    if child >= LOSS:
+        return child - LOSS + 1
+    return LOSS + child + 1
+
+
+# Returns the score of a table value for the side to move, mates in the table rank
+# below mates the search finds itself
+TABLEBASE_WIN = 9000
+# every win or loss of a table scores at least this much, also once the search adds
+# the plies from its root to the distance
+TABLEBASE_SCORE_MIN = TABLEBASE_WIN - 500
+
+
+def scoreOf(value):
+    if value == DRAW:
+        return 0
+    if value >= LOSS:
+        return -(TABLEBASE_WIN - (value - LOSS))
+    return TABLEBASE_WIN - value
+
+
+# Returns the names of the tables reached from name by a capture or a promotion
+def subtables(name):
+    layout = layoutOf(name)
+    names = set()
+    for i, piece in enumerate(layout):
+        if piece[1] == "K":
+            continue
+        rest = layout[:i] + layout[i + 1 :]
+        names.add(materialName(rest)[0])
+        if piece[1] == "p":
+            for promotion in PROMOTIONS:
+                promoted = rest + [piece[0] + promotion]
+                names.add(materialName(promoted)[0])
+                # promoting with a capture
+                for j, other in enumerate(rest):
+                    if other[0] != piece[0] and other[1] != "K":
+                        captured = rest[:j] + rest[j + 1 :] + [piece[0] + promotion]
+                        names.add(materialName(captured)[0])
+    names.discard(name)
+    return sorted(names)
+
+
+# Writes the table of name to directory, generating the tables it depends on first
+# when missing. log is called with progress messages. Returns the path written.
+def generate(name, directory=DEFAULT_DIRECTORY, log=print):
+    name = materialName(layoutOf(name))[0]
+    layout = layoutOf(name)
+    n = len(layout)
+    if n > MAX_PIECES:
+        raise ValueError("Tables go up to " + str(MAX_PIECES) + " pieces: " + name)
+    os.makedirs(directory, exist_ok=True)
+    tablebase = Tablebase(directory)
+    for subtable in subtables(name):
+        if subtable not in DRAWN and not os.path.exists(tablebase.path(subtable)):
+            generate(subtable, directory, log)
+
+    start = time.time()
+    size = 2 * 64**n
+    table = bytearray([UNKNOWN]) * size
+    # number of moves staying in the table not yet known to lose
+    remaining = bytearray(size)
+    # 1 when a capture or promotion saves at least a draw
+    cannotLose = bytearray(size)
+    # longest loss through a capture or promotion
+    exitLoss = bytearray(size)
+    # positions to resolve later, by ply: list of (index, value)
+    pending = {}
+
+    # Every position: its legal moves, mates, stalemates and the results of the
+    # moves leaving the table
+    current = []
+    for whiteTurn in (True, False):
+        index = indexOf([0] * n, whiteTurn)
+        for squares in product(range(64), repeat=n):
+            if not isLegal(layout, squares, whiteTurn):
+                table[index] = INVALID
+                index += 1
+                continue
+            count = 0
+            bestWin = None
+            for i, end, captured, promotion in legalMoves(layout, squares, whiteTurn):
+                if captured < 0 and promotion is None:
+                    count += 1
+                    continue
+                pieces = []
+                for j, piece in enumerate(layout):
+                    if j == i:
+                        piece = piece if promotion is None else piece[0] + promotion
+                        pieces.append((piece, end))
+                    elif j != captured:
+                        pieces.append((piece, squares[j]))
+                value = parentValue(tablebase.lookup(pieces, not whiteTurn))
+                if value < LOSS:
+                    cannotLose[index] = 1
+                    if value != DRAW and (bestWin is None or value < bestWin):
+                        bestWin = value
+                else:
+                    exitLoss[index] = max(exitLoss[index], value - LOSS)
+
+            if count == 0 and not cannotLose[index] and exitLoss[index] == 0:
+                checked = not isLegal(layout, squares, not whiteTurn)
+                table[index] = LOSS if checked else DRAW
+                if checked:
+                    current.append(index)
+            else:
+                remaining[index] = count
+                if bestWin is not None:
+                    pending.setdefault(bestWin, []).append((index, bestWin))
+                elif count == 0 and not cannotLose[index]:
+                    pending.setdefault(exitLoss[index], []).append(
+                        (index, LOSS + exitLoss[index])
+                    )
+            index += 1
+    log("%s: %d positions set up in %.1fs" % (name, size, time.time() - start))
+
+    # Retrograde analysis, one ply at a time: a position with a move to a lost
+    # position is won, one whose moves all reach won positions is lost
+    ply = 0
+    while current or any(level >= ply for level in pending):
+        for index, value in pending.pop(ply, []):
+            if table[index] == UNKNOWN:
+                table[index] = value
+                current.append(index)
+        following = []
+        for index in current:
+            lost = table[index] >= LOSS
+            squares, whiteTurn = positionOf(index, n)
+            occupied = 0
+            for sq in squares:
+                occupied |= 1 << sq
+            moved = "b" if whiteTurn else "w"
+            for i, piece in enumerate(layout):
+                if piece[0] != moved:
+                    continue
+                origins = retractions(layout, squares, i, occupied)
+                while origins:
+                    origin = (origins & -origins).bit_length() - 1
+                    origins &= origins - 1
+                    before = list(squares)
+                    before[i] = origin
+                    parent = indexOf(before, not whiteTurn)
+                    if table[parent] != UNKNOWN:
+                        continue
+                    if lost:
+                        table[parent] = ply + 1
+                        following.append(parent)
+                        continue
+                    remaining[parent] -= 1
+                    if remaining[parent] == 0 and not cannotLose[parent]:
+                        if exitLoss[parent] <= ply + 1:
+                            table[parent] = LOSS + ply + 1
+                            following.append(parent)
+                        else:
+                            pending.setdefault(exitLoss[parent], []).append(
+                                (parent, LOSS + exitLoss[parent])
+                            )
+        current = following
+        ply += 1
+        if ply >= LOSS - 1:
+            raise ValueError("Mates longer than a byte can hold in " + name)
+
+    # Whatever is left can never be forced either way
+    for index in range(size):
+        if table[index] == UNKNOWN:
+            table[index] = DRAW
+
+    path = tablebase.path(name)
+    with open(path + ".tmp", "wb") as file:
+        file.write(table)
+    os.replace(path + ".tmp", path)
+    tablebase.close()
+    log("%s: written to %s in %.1fs" % (name, path, time.time() - start))
+    return path
+
+
+# Returns a readable description of a table value
+def describe(value):
+    if value is None:
+        return "not in the tablebase"
+    if value == INVALID:
+        return "illegal position"
+    if value == DRAW:
+        return "draw"
+    if value >= LOSS:
+        return "lost, mated in " + str(value - LOSS) + " plies"
+    return "won, mate in " + str(value) + " plies"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Endgame tablebase generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="generate tables by material")
+    build.add_argument("names", nargs="+", help="materials such as KQK or KRKP")
+    build.add_argument("--directory", default=DEFAULT_DIRECTORY)
+    probe = commands.add_parser("probe", help="look a position up")
+    probe.add_argument("--fen", required=True)
+    probe.add_argument("--directory", default=DEFAULT_DIRECTORY)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for name in args.names:
+            generate(name.upper(), args.directory)
+        return 0
+
+    gs = ChessEngine.GameState()
+    gs.setFen(args.fen)
+    tablebase = Tablebase(args.directory)
+    print(describe(tablebase.probe(gs)))
+    best = tablebase.bestMove(gs)
+    if best is not None:
+        print("best move " + ChessEngine.moveNotation(best[0]))
+    tablebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
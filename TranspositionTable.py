@@ -0,0 +1,205 @@
+# Transposition table storing the results of previously searched positions,
+# keyed by the zobrist hash of the position
+import struct
+from multiprocessing import shared_memory
+
+# Bound types of a stored score
+EXACT = 0
+LOWERBOUND = 1
+UPPERBOUND = 2
+
+# Approximate memory used by one entry (list slot + tuple + its ints)
+ENTRY_BYTES = 112
+
+DEFAULT_SIZE_MB = 16
+
+
+class TranspositionTable:
+    # sizeMb : memory cap of the table in megabytes
+    def __init__(self, sizeMb=DEFAULT_SIZE_MB):
+        self.generation = 0
+        self.resize(sizeMb)
+
+    # Reallocates the table for a new memory cap, dropping all entries
+    def resize(self, sizeMb):
+        self.size = max(1, int(sizeMb * 1024 * 1024) // ENTRY_BYTES)
+        # Each slot is None or (key, depth, flag, score, bestMove, generation)
+        self.table = [None] * self.size
+        self.hits = 0
+        self.stores = 0
+
+    def clear(self):
+        self.table = [None] * self.size
+        self.hits = 0
+        self.stores = 0
+
+    # Called at the start of every search so entries from older searches get replaced first
+    def newSearch(self):
+        self.generation += 1
+
+    # Returns the entry stored for key, or None if there is none
+    def probe(self, key):
+        entry = self.table[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    # Stores a search result given:
+    # key : zobrist hash of the position
+    # depth : remaining depth the position was searched to
+    # flag : EXACT, LOWERBOUND (fail high) or UPPERBOUND (fail low)
+    # score : score relative to the side to move
+    # bestMove : best (or refutation) move found, may be None
+    def store(self, key, depth, flag, score, bestMove):
+        index = key % self.size
+        entry = self.table[index]
+        # Depth preferred replacement, but always replace entries of older searches
+        if (
+            entry is None
+            or entry[0] == key
+            or entry[5] != self.generation
+            or depth >= entry[1]
+        ):
+            # Keep the previous best move when the new result has none
+            if bestMove is None and entry is not None and entry[0] == key:
+                bestMove = entry[4]
+            self.table[index] = (key, depth, flag, score, bestMove, self.generation)
+            self.stores += 1
+
+    # Returns the permille of slots in use
+    def hashfull(self):
+        sample = min(self.size, 1000)
+        used = sum(1 for entry in self.table[:sample] if entry is not None)
+        return used * 1000 // sample
+
+
+# Each shared entry is two unsigned 64 bit ints: (key ^ data, data)
+ENTRY = struct.Struct("<QQ")
+# Scores are stored as integers in thousandths of a pawn
+SCORE_SCALE = 1000
+SCORE_OFFSET = 1 << 31
+# Moves are stored as their 16 bit ints, 0 (a8 to a8) meaning no move
+NO_MOVE = 0
+
+
+# Transposition table living in a multiprocessing.shared_memory buffer so several
+# processes can search with it at once. Entries are written without locks, a torn
+# or overwritten entry fails the key check when read and is treated as a miss.
+# Best moves must be 16 bit ints.
+class SharedTranspositionTable:
+    # sizeMb : memory cap of the table in megabytes, when creating it
+    # name, size : name and number of entries of an existing table to attach to
+    def __init__(self, sizeMb=DEFAULT_SIZE_MB, name=None, size=None):
+        self.generation = 0
+        self.hits = 0
+        self.stores = 0
+        self.sizeMb = sizeMb
+        if name is None:
+            self.size = max(1, int(sizeMb * 1024 * 1024) // ENTRY.size)
+            self.memory = shared_memory.SharedMemory(
+                create=True, size=self.size * ENTRY.size
+            )
+            self.owner = True
+        else:
+            self.size = size
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+
+    def clear(self):
+        self.buffer[:] = bytes(self.size * ENTRY.size)
+        self.hits = 0
+        self.stores = 0
+
+    def newSearch(self):
+        self.generation += 1
+
+    def probe(self, key):
+        check, data = ENTRY.unpack_from(self.buffer, (key % self.size) * ENTRY.size)
+        if check ^ data != key:
+            return None
+        self.hits += 1
+        move = (data >> 42) & 0xFFFF
+        return (
+            key,
+            (data >> 32) & 0xFF,
+            (data >> 40) & 0x3,
+            ((data & 0xFFFFFFFF) - SCORE_OFFSET) / SCORE_SCALE,
+            None if move == NO_MOVE else move,
+            data >> 58,
+        )
+
+    # See TranspositionTable.store
+    def store(self, key, depth, flag, score, bestMove):
+        offset = (key % self.size) * ENTRY.size
+        check, data = ENTRY.unpack_from(self.buffer, offset)
+        generation = self.generation & 0x3F
+        sameKey = check ^ data == key
+        if not (
+            data == 0
+            or sameKey
+            or data >> 58 != generation
+            or depth >= (data >> 32) & 0xFF
+        ):
+            return
+
+        if bestMove is None:
+            bestMove = (data >> 42) & 0xFFFF if sameKey else NO_MOVE
+        score = max(-SCORE_OFFSET, min(SCORE_OFFSET - 1, score * SCORE_SCALE))
+        score = int(round(score)) + SCORE_OFFSET
+        data = (
+            score
+            | (min(depth, 0xFF) << 32)
+            | (flag << 40)
+            | (bestMove << 42)
+            | (generation << 58)
+        )
+        ENTRY.pack_into(self.buffer, offset, key ^ data, data)
+        self.stores += 1
+
+    def hashfull(self):
+        sample = min(self.size, 1000)
+        used = 0
+        for i in range(sample):
+            if ENTRY.unpack_from(self.buffer, i * ENTRY.size)[1] != 0:
+                used += 1
+        return used * 1000 // sample
+
+    # Detaches from the buffer, the creating process also frees it
+    def close(self):
+        self.buffer.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# Cache of pawn structure scores keyed by the zobrist hash of the pawns alone,
+# pawn placement changes far less often than evaluate is called
+class PawnHashTable:
+    def __init__(self, sizeMb=2):
+        self.resize(sizeMb)
+
+    def resize(self, sizeMb):
+        self.size = max(1, int(sizeMb * 1024 * 1024) // ENTRY_BYTES)
+        # Each slot is None or (key, score)
+        self.table = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.resize(self.size * ENTRY_BYTES / (1024 * 1024))
+
+    # Returns the score stored for key, or None
+    def probe(self, key):
+        entry = self.table[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    # Always replaces, pawn structures are cheap to recompute
+    def store(self, key, score):
+        self.table[key % self.size] = (key, score)
@@ -0,0 +1,313 @@
+# UCI front end: lets GUIs and match managers run the AI without pygame.
+# Commands are read from stdin, the search runs on a background thread so stop and
+# ponderhit are answered while it thinks.
+#
+# python3 UCI.py
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import ChessAI
+import ChessEngine
+import BitboardEngine
+import Tablebase
+
+NAME = "Chess-AI"
+AUTHOR = "Louis Nguyen, Alex Zhao"
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# name : (type, default, min, max), see setOption for what each one does
+OPTIONS = {
+    "Hash": ("spin", 16, 1, 4096),
+    "Threads": ("spin", 1, 1, 64),
+    "Ponder": ("check", False, None, None),
+    "OwnBook": ("check", True, None, None),
+    "BookFile": ("string", "book.bin", None, None),
+    "TablebasePath": ("string", "<empty>", None, None),
+    "NullMove": ("check", True, None, None),
+    "LateMoveReductions": ("check", True, None, None),
+}
+
+
+class Engine:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.gs = BitboardEngine.GameState()
+        self.options = {name: option[1] for name, option in OPTIONS.items()}
+        self.thread = None
+        # set by stop, read by the search through ChessAI.stopSignal
+        self.stop = multiprocessing.Value("b", 0)
+        # set when an infinite or ponder search may send its best move
+        self.released = threading.Event()
+        # time budget of a ponder search, applied on ponderhit
+        self.ponderTime = None
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    # Handles one command line, returns False on quit
+    def command(self, line):
+        words = line.split()
+        if len(words) == 0:
+            return True
+        name, args = words[0], words[1:]
+        if name == "uci":
+            self.send("id name " + NAME)
+            self.send("id author " + AUTHOR)
+            for option, (kind, default, low, high) in OPTIONS.items():
+                text = "option name %s type %s default %s" % (
+                    option,
+                    kind,
+                    str(default).lower() if kind == "check" else default,
+                )
+                if kind == "spin":
+                    text += " min %d max %d" % (low, high)
+                self.send(text)
+            self.send("uciok")
+        elif name == "isready":
+            self.send("readyok")
+        elif name == "setoption":
+            self.waitForSearch()
+            self.setOption(args)
+        elif name == "ucinewgame":
+            self.waitForSearch()
+            ChessAI.transpositionTable.clear()
+            ChessAI.resetOrdering()
+        elif name == "position":
+            self.waitForSearch()
+            self.setPosition(args)
+        elif name == "go":
+            self.waitForSearch()
+            self.go(args)
+        elif name == "stop":
+            self.stopSearch()
+        elif name == "ponderhit":
+            self.ponderHit()
+        elif name == "quit":
+            self.stopSearch()
+            return False
+        return True
+
+    # setoption name <name> [value <value>]
+    def setOption(self, args):
+        if "name" not in args:
+            return
+        split = args.index("value") if "value" in args else len(args)
+        name = " ".join(args[args.index("name") + 1 : split])
+        value = " ".join(args[split + 1 :])
+        if name not in OPTIONS:
+            self.send("info string unknown option " + name)
+            return
+        kind, default, low, high = OPTIONS[name]
+        if kind == "spin":
+            value = max(low, min(high, int(value)))
+        elif kind == "check":
+            value = value.lower() == "true"
+        self.options[name] = value
+
+        if name == "Hash":
+            ChessAI.setHashSize(value)
+        elif name in ("OwnBook", "BookFile"):
+            self.loadBook()
+        elif name == "TablebasePath":
+            empty = value in ("", "<empty>")
+            ChessAI.setTablebase(None if empty else value)
+        elif name in ("NullMove", "LateMoveReductions"):
+            ChessAI.setSelectivity(
+                self.options["NullMove"], self.options["LateMoveReductions"]
+            )
+
+    def loadBook(self):
+        try:
+            if self.options["OwnBook"] and self.options["BookFile"] != "<empty>":
+                ChessAI.setOpeningBook(self.options["BookFile"])
+            else:
+                ChessAI.setOpeningBook(None)
+        except (OSError, ValueError) as error:
+            ChessAI.setOpeningBook(None)
+            self.send("info string no opening book: " + str(error))
+
+    # position [startpos | fen <fen>] [moves <move> ...]
+    def setPosition(self, args):
+        split = args.index("moves") if "moves" in args else len(args)
+        if args[:1] == ["fen"]:
+            fen = " ".join(args[1:split])
+        else:
+            fen = START_FEN
+        self.gs.setFen(fen)
+        for text in args[split + 1 :]:
+            move = parseMove(self.gs, text)
+            if move is None:
+                self.send("info string illegal move " + text)
+                return
+            self.gs.makeMove(move)
+
+    # go [wtime/btime/winc/binc/movestogo <ms>] [movetime <ms>] [depth <n>]
+    #    [infinite] [ponder]
+    def go(self, args):
+        limits = {}
+        for i, word in enumerate(args[:-1]):
+            if args[i + 1].lstrip("-").isdigit():
+                limits[word] = int(args[i + 1])
+        white = self.gs.whiteTurn
+        clock = limits.get("wtime" if white else "btime")
+        increment = limits.get("winc" if white else "binc", 0)
+        moveTime = limits.get("movetime")
+        if moveTime is None and clock is not None and "movestogo" in limits:
+            moveTime = min(clock / max(limits["movestogo"], 1) + increment, clock)
+            clock = None
+
+        ponder = "ponder" in args
+        infinite = "infinite" in args or ponder
+        if ponder:
+            # the clock only runs once the opponent plays the expected move
+            self.ponderTime = (moveTime, clock, increment)
+            moveTime, clock = None, None
+        self.stop.value = 0
+        ChessAI.stopTime = None
+        self.released.clear()
+        if not infinite:
+            self.released.set()
+        self.thread = threading.Thread(
+            target=self.search,
+            args=(moveTime, clock, increment, limits.get("depth", 64)),
+            daemon=True,
+        )
+        self.thread.start()
+
+    # Runs on the search thread and sends the best move when allowed
+    def search(self, moveTime, clock, increment, maxDepth):
+        ChessAI.stopSignal = self.stop
+        ChessAI.resetStats()
+        start = time.time()
+        white = 1 if self.gs.whiteTurn else -1
+        try:
+            if self.options["Threads"] > 1:
+                move = ChessAI.lazySmp(
+                    self.gs,
+                    white,
+                    moveTime,
+                    clock,
+                    increment,
+                    maxDepth,
+                    self.info,
+                    threads=self.options["Threads"],
+                    sizeMb=self.options["Hash"],
+                )
+            else:
+                move = ChessAI.iterativeDeepening(
+                    self.gs, white, moveTime, clock, increment, maxDepth, self.info
+                )
+        finally:
+            ChessAI.stopSignal = None
+            ChessAI.stopTime = None
+
+        elapsed = max(time.time() - start, 1e-9)
+        if ChessAI.nodes > 0:
+            self.send(
+                "info string %d nodes in %.2fs, null move cutoffs %d, reductions %d, "
+                "re-searches %d"
+                % (
+                    ChessAI.nodes,
+                    elapsed,
+                    ChessAI.stats["nullMoveCutoffs"],
+                    ChessAI.stats["reductions"],
+                    ChessAI.stats["reSearches"],
+                )
+            )
+        # infinite and ponder searches answer only after stop or ponderhit
+        self.released.wait()
+        if move is None:
+            self.send("bestmove 0000")
+            return
+        text = "bestmove " + ChessEngine.moveNotation(move)
+        self.gs.makeMove(move)
+        reply = ChessAI.principalVariation(self.gs, 1)
+        self.gs.undoMove()
+        if len(reply) > 0:
+            text += " ponder " + ChessEngine.moveNotation(reply[0])
+        self.send(text)
+
+    # onIteration callback of the search
+    def info(self, depth, score, nodes, seconds, pv):
+        # mates and tablebase wins count plies from the root
+        plies = None
+        if abs(score) >= ChessAI.MATE_BOUND:
+            plies = round(ChessAI.MATE - abs(score))
+        elif abs(score) >= Tablebase.TABLEBASE_SCORE_MIN:
+            plies = round(Tablebase.TABLEBASE_WIN - abs(score))
+        if plies is not None:
+            moves = (plies + 1) // 2
+            scoreText = "mate " + str(moves if score > 0 else -moves)
+        else:
+            scoreText = "cp " + str(round(score * 100))
+        self.send(
+            "info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s"
+            % (
+                depth,
+                scoreText,
+                nodes,
+                nodes / max(seconds, 1e-9),
+                seconds * 1000,
+                ChessAI.transpositionTable.hashfull(),
+                " ".join(ChessEngine.moveNotation(move) for move in pv),
+            )
+        )
+
+    def stopSearch(self):
+        self.stop.value = 1
+        self.released.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # The opponent played the expected move: the ponder search goes on as a normal
+    # search with the clock of the go command
+    def ponderHit(self):
+        if self.ponderTime is not None:
+            budget = ChessAI.timeBudget(*self.ponderTime)
+            if budget is not None:
+                ChessAI.stopTime = time.time() + budget
+            self.ponderTime = None
+        self.released.set()
+
+    # Waits for a finished search to send its move, a GUI never sends a command
+    # other than stop or ponderhit while the engine is still thinking
+    def waitForSearch(self):
+        if self.thread is not None:
+            if not self.released.is_set():
+                self.stopSearch()
+            self.thread.join()
+            self.thread = None
+
+
+# Returns the legal move of gs written in long algebraic notation (e2e4, e7e8q),
+# or None
+def parseMove(gs, text):
+    for move in gs.getValidMoves():
+        if ChessEngine.moveNotation(move) == text:
+            return move
+    return None
+
+
+def main():
+    engine = Engine()
+    if os.path.exists(engine.options["BookFile"]):
+        engine.loadBook()
+    # worker processes close sys.stdin when they start, which would wait forever on
+    # the lock held by a read blocked in it, so commands are read through another
+    # file object
+    commands = open(sys.stdin.fileno(), closefd=False)
+    for line in commands:
+        if not engine.command(line):
+            break
+    engine.stopSearch()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,99 +1,69 @@
 # A program to illustrate Zobrist Hashing Algorithm
 # Taken from GeeksforGeeks
 # at https://www.geeksforgeeks.org/minimax-algorithm-in-game-theory-set-5-zobrist-hashing/amp/
+# Extended to hash the side to move, castling rights and en passant file, with a
+# fixed seed so keys are identical across processes and runs.
 
 
 import random
 
-# Generates a Random number from 0 to 2^64-1
-
-
-def randomInt():
-
-    min = 0
-
-    max = pow(2, 64)
+# Seed of the key generator, changing it invalidates every stored key
+SEED = 3821
+
+PIECE_INDEX = {
+    "wp": 0,
+    "wN": 1,
+    "wB": 2,
+    "wR": 3,
+    "wQ": 4,
+    "wK": 5,
+    "bp": 6,
+    "bN": 7,
+    "bB": 8,
+    "bR": 9,
+    "bQ": 10,
+    "bK": 11,
+}
 
-    return random.randint(min, max)
 
-
-# This function associates each piece with
-# a number
+# Generates a Random number from 0 to 2^64-1
+def randomInt(generator):
+    return generator.getrandbits(64)
 
 
+# This function associates each piece with a number
 def indexOf(piece):
-
-    if piece == "wp":
-
-        return 0
-
-    elif piece == "wN":
-
-        return 1
-
-    elif piece == "wB":
-
-        return 2
-
-    elif piece == "wR":
-
-        return 3
-
-    elif piece == "wQ":
-
-        return 4
-
-    elif piece == "wK":
-
-        return 5
-
-    elif piece == "bp":
-
-        return 6
-
-    elif piece == "bN":
-
-        return 7
-
-    elif piece == "bB":
-
-        return 8
-
-    elif piece == "bR":
-
-        return 9
-
-    elif piece == "bQ":
-
-        return 10
-
-    elif piece == "bK":
-
-        return 11
-
-    else:
-
-        return -1
+    return PIECE_INDEX.get(piece, -1)
 
 
 # Initializes the table
-
-
 def initTable():
+    generator = random.Random(SEED)
 
     # 8x8x12 array
-
     ZobristTable = [
-        [[randomInt() for k in range(12)] for j in range(8)] for i in range(8)
+        [[randomInt(generator) for k in range(12)] for j in range(8)] for i in range(8)
     ]
 
-    return ZobristTable
+    return ZobristTable, initExtraKeys(generator)
+
 
+# Keys for the non-board state, drawn after the piece keys
+def initExtraKeys(generator):
+    side = randomInt(generator)
+    # one key per castling rights mask (wK = 1, wQ = 2, bK = 4, bQ = 8)
+    castle = [randomInt(generator) for i in range(16)]
+    # one key per en passant file
+    enpassant = [randomInt(generator) for i in range(8)]
+    return side, castle, enpassant
 
-# Computes the hash value of a given board
 
+# Every GameState shares the same keys
+ZobristTable, (SIDE, CASTLE, ENPASSANT) = initTable()
 
-def initHash(board, ZobristTable):
+
+# Computes the hash value of a given position
+def initHash(board, ZobristTable, whiteTurn=True, castle=15, enpassant=()):
 
     h = 0
 
@@ -107,16 +77,59 @@ def initHash(board, ZobristTable):
 
                 h ^= ZobristTable[i][j][piece]
 
+    if not whiteTurn:
+        h ^= SIDE
+    h ^= CASTLE[castle]
+    if enpassant != ():
+        h ^= ENPASSANT[enpassant[1]]
+
     return h
 
 
 # A function that hashes the current gs given previous hash and current move
-def hashMove(move, previous, Zobrist):
-    newHash = previous ^ Zobrist[move.startRow][move.startCol][indexOf(move.pieceMoved)]
-    newHash = newHash ^ Zobrist[move.endRow][move.endCol][indexOf(move.pieceMoved)]
-    if move.pieceCaptured != "--":
-        newHash = (
-            newHash ^ Zobrist[move.endRow][move.endCol][indexOf(move.pieceCaptured)]
-        )
+# move : the move just made, packed as in ChessEngine
+# previous : hash before the move
+# placedPiece : piece now standing on the end square (differs from pieceMoved on promotion)
+# oldCastle, newCastle : castling rights masks before and after the move
+# oldEnpassant, newEnpassant : en passant squares before and after the move
+def hashMove(
+    move,
+    previous,
+    Zobrist,
+    pieceMoved,
+    pieceCaptured,
+    placedPiece,
+    oldCastle,
+    newCastle,
+    oldEnpassant,
+    newEnpassant,
+):
+    startRow, startCol = divmod(move & 63, 8)
+    endRow, endCol = divmod((move >> 6) & 63, 8)
+    flags = (move >> 12) & 15
+    newHash = previous ^ Zobrist[startRow][startCol][indexOf(pieceMoved)]
+    newHash = newHash ^ Zobrist[endRow][endCol][indexOf(placedPiece)]
+    if pieceCaptured != "--":
+        # en passant (flag 5) takes the pawn beside the start square
+        captureRow = startRow if flags == 5 else endRow
+        newHash = newHash ^ Zobrist[captureRow][endCol][indexOf(pieceCaptured)]
+
+    # rook hop of a castle move (flag 2 kingside, 3 queenside)
+    if flags == 2 or flags == 3:
+        rook = pieceMoved[0] + "R"
+        if flags == 2:
+            rookStart, rookEnd = endCol + 1, endCol - 1
+        else:
+            rookStart, rookEnd = endCol - 2, endCol + 1
+        newHash ^= Zobrist[endRow][rookStart][indexOf(rook)]
+        newHash ^= Zobrist[endRow][rookEnd][indexOf(rook)]
+
+    newHash ^= SIDE
+    if oldCastle != newCastle:
+        newHash ^= CASTLE[oldCastle] ^ CASTLE[newCastle]
+    if oldEnpassant != ():
+        newHash ^= ENPASSANT[oldEnpassant[1]]
+    if newEnpassant != ():
+        newHash ^= ENPASSANT[newEnpassant[1]]
 
     return newHash